@@ -0,0 +1,288 @@
+"""Бенчмарки горячих путей эмулятора (без графического интерфейса)
+
+Генерирует синтетическое дерево (глубина, ветвление, размеры файлов
+задаются параметрами), замеряет загрузку VFS, разрешение путей,
+vfs-ls -l, vfs-tail, tail, ls -l и выполнение скрипта, сохраняет
+результаты в JSON и сравнивает их с базовой линией:
+
+    python bench.py --save-baseline          # записать bench_baseline.json
+    python bench.py                          # сравнить с bench_baseline.json
+    python bench.py --output results.json --threshold 0.3
+
+Код возврата 1 - хотя бы один замер (лучшее время из --repeat серий)
+медленнее базовой линии больше чем на threshold."""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import emu
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+TREE_MARKER = '.bench_tree.json'  # Параметры, с которыми сгенерировано дерево
+# Большой файл для tail и vfs-tail; расширение .txt - VFS читает содержимое
+# только текстовых файлов (VFS._read_file), иначе vfs-tail замерял бы заглушку
+LOG_NAME = 'bench_log.txt'
+TREE_VERSION = 2                  # Меняется вместе с составом генерируемого дерева
+SCRIPT_NAME = 'bench_script.txt'  # Скрипт для замера run_script
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Бенчмарки эмулятора')
+    parser.add_argument('--tree', metavar='DIR',
+                        help='Директория синтетического дерева (по умолчанию - временная)')
+    parser.add_argument('--depth', type=int, default=3, help='Глубина дерева')
+    parser.add_argument('--fanout', type=int, default=8, help='Поддиректорий в каждой директории')
+    parser.add_argument('--files', type=int, default=50, help='Файлов в каждой директории')
+    parser.add_argument('--file-size', type=int, default=4096, metavar='BYTES',
+                        help='Средний размер файла (размеры случайны от 0 до 2*BYTES)')
+    parser.add_argument('--log-mb', type=int, default=64, metavar='MB',
+                        help='Размер большого файла для tail и vfs-tail')
+    parser.add_argument('--script-lines', type=int, default=2000, metavar='N',
+                        help='Число строк скрипта для run_script')
+    parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Повторов каждого замера (сравнивается лучшее время)')
+    parser.add_argument('--only', action='append', default=[], metavar='NAME',
+                        help='Выполнить только указанные замеры (можно несколько раз)')
+    parser.add_argument('--output', metavar='FILE', help='Сохранить результаты в JSON')
+    parser.add_argument('--baseline', default=BASELINE_FILE, metavar='FILE',
+                        help='Базовая линия для сравнения (по умолчанию bench_baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Записать результаты как новую базовую линию')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Допустимое замедление относительно базовой линии (0.2 - 20%%)')
+    return parser.parse_args()
+
+
+# === СИНТЕТИЧЕСКОЕ ДЕРЕВО ===
+
+def tree_params(args):
+    return {'version': TREE_VERSION, 'depth': args.depth, 'fanout': args.fanout, 'files': args.files,
+            'file_size': args.file_size, 'log_mb': args.log_mb,
+            'script_lines': args.script_lines, 'seed': args.seed}
+
+
+def make_tree(root, version, depth, fanout, files, file_size, log_mb, script_lines, seed):
+    """Создает дерево директорий и файлов, большой лог и скрипт
+
+    При одинаковых параметрах дерево получается одинаковым (random с seed),
+    поэтому результаты разных запусков сравнимы."""
+    rng = random.Random(seed)
+    level = [root]
+    for current_depth in range(depth + 1):
+        next_level = []
+        for directory in level:
+            for i in range(files):
+                size = rng.randint(0, 2 * file_size)
+                with open(os.path.join(directory, f'file_{i:04d}.txt'), 'wb') as f:
+                    f.write(b'x' * size)
+            if current_depth < depth:
+                for i in range(fanout):
+                    subdir = os.path.join(directory, f'dir_{i:03d}')
+                    os.mkdir(subdir)
+                    next_level.append(subdir)
+        level = next_level
+
+    # Лог из строк разной длины, как у настоящих журналов
+    line_count = 0
+    with open(os.path.join(root, LOG_NAME), 'w', encoding='utf-8') as f:
+        written = 0
+        while written < log_mb * 1024 * 1024:
+            line = f"{line_count:09d} INFO request {rng.random():.6f} " + 'a' * rng.randint(0, 120) + '\n'
+            f.write(line)
+            written += len(line)
+            line_count += 1
+
+    # Скрипт из типичных команд навигации и листинга VFS
+    commands = ['vfs-pwd', 'vfs-cd dir_000', 'vfs-ls', 'vfs-cd ..', 'echo bench',
+                f'vfs-head -n 5 {LOG_NAME}']
+    with open(os.path.join(root, SCRIPT_NAME), 'w', encoding='utf-8') as f:
+        for i in range(script_lines):
+            f.write(commands[i % len(commands)] + '\n')
+
+
+def prepare_tree(args):
+    """Возвращает директорию дерева, генерируя его, если параметры изменились"""
+    root = args.tree or os.path.join(tempfile.gettempdir(), 'emu_bench_tree')
+    params = tree_params(args)
+    marker = os.path.join(root, TREE_MARKER)
+    try:
+        with open(marker, encoding='utf-8') as f:
+            if json.load(f) == params:
+                return root
+    except (OSError, ValueError):
+        pass
+
+    if os.path.exists(root):
+        # Удаляем только дерево, созданное bench.py (с маркером), или пустую
+        # директорию - опечатка в --tree не должна стереть чужие данные
+        if os.path.exists(marker):
+            shutil.rmtree(root)
+        elif not os.path.isdir(root) or os.listdir(root):
+            raise SystemExit(f"bench: {root}: директория не пуста и не создана bench.py")
+    os.makedirs(root, exist_ok=True)
+    print(f"Генерация дерева в {root}...", file=sys.stderr)
+    make_tree(root, **params)
+    # Маркер пишется последним: прерванная генерация повторится при следующем запуске
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    return root
+
+
+# === ЗАМЕРЫ ===
+
+def measure(function, repeat, number=1):
+    """Время одного вызова function: медиана и минимум из repeat серий по number вызовов"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    times.sort()
+    return {'median': times[len(times) // 2], 'min': times[0], 'repeat': repeat, 'number': number}
+
+
+def run_benchmarks(root, args, sink):
+    """Выполняет замеры, возвращает словарь имя -> результат measure"""
+    results = {}
+    vfs = emu.vfs
+    # Лог должен помещаться в кэш содержимого (как с --vfs-cache-mb побольше),
+    # иначе vfs-tail (cached) и vfs-head в скрипте каждый раз перечитывают файл
+    vfs.content_cache.max_bytes = max(vfs.content_cache.max_bytes,
+                                      2 * args.log_mb * 1024 * 1024 + 16 * 1024 * 1024)
+    wanted = set(args.only)
+
+    def bench(name, function, number=1, repeat=args.repeat):
+        if wanted and name not in wanted:
+            return
+        results[name] = measure(function, repeat, number)
+        print(f"{name:<24} {results[name]['median'] * 1000:12.3f} мс", file=sys.stderr)
+
+    def execute(*argv):
+        return lambda: emu.execute_argv(list(argv), sink)
+
+    # Загрузка печатает сообщения в stdout - они не относятся к замеру
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        bench('load_full', lambda: vfs.load_from_real_directory(root),
+              repeat=min(args.repeat, 3))
+        bench('load_lazy', lambda: vfs.load_from_real_directory(root, lazy=True))
+        vfs.load_from_real_directory(root)
+
+    # Разрешение путей: одни и те же случайные, но воспроизводимые пути
+    rng = random.Random(args.seed)
+    paths = sorted(vfs.path_index)
+    sample = [rng.choice(paths) for _ in range(1000)] if paths else ['/']
+    relative = [path.lstrip('/') for path in sample]
+    bench('resolve_absolute_path',
+          lambda: [vfs._resolve_absolute_path(path) for path in relative], number=10)
+    bench('resolve_relative_path',
+          lambda: [vfs._resolve_relative_path(path) for path in relative], number=10)
+    bench('resolve_dotted_path',
+          lambda: [vfs._resolve_relative_path(path + '/../.') for path in relative], number=10)
+
+    bench('vfs-ls -l', execute('vfs-ls', '-l', '/'), number=20)
+    bench('vfs-ls -l -S', execute('vfs-ls', '-l', '-S', '/dir_000'), number=20)
+
+    def vfs_tail_cold():
+        vfs.content_cache.clear()
+        emu.execute_argv(['vfs-tail', '-n', '100', LOG_NAME], sink)
+    bench('vfs-tail (cold)', vfs_tail_cold)
+    bench('vfs-tail (cached)', execute('vfs-tail', '-n', '100', LOG_NAME), number=20)
+
+    log_path = os.path.join(root, LOG_NAME)
+    bench('tail -n 100', execute('tail', '-n', '100', log_path), number=50)
+    bench('tail -c 1M', execute('tail', '-c', str(1024 * 1024), log_path), number=10)
+    bench('ls -l', execute('ls', '-l', root), number=20)
+    bench('ls -R', execute('ls', '-R', root))
+
+    script_path = os.path.join(root, SCRIPT_NAME)
+    bench('run_script', lambda: emu.run_script(script_path, sink, sink.write))
+    if 'run_script' in results:
+        results['run_script']['lines_per_second'] = args.script_lines / results['run_script']['median']
+    return results
+
+
+# === БАЗОВАЯ ЛИНИЯ ===
+
+def compare(results, baseline, threshold):
+    """Сравнивает с базовой линией, возвращает список замедлившихся замеров
+
+    Сравнивается лучшее время серии (min): медиана сильнее зависит от
+    фоновой нагрузки машины и дает ложные регрессии."""
+    regressions = []
+    print(f"\n{'BENCHMARK':<24} {'BASELINE':>12} {'CURRENT':>12} {'CHANGE':>8}  (min, мс)")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<24} {'-':>12} {result['min'] * 1000:12.3f}")
+            continue
+        change = result['min'] / base['min'] - 1 if base['min'] else 0.0
+        mark = ''
+        if change > threshold:
+            mark = '  РЕГРЕССИЯ'
+            regressions.append(name)
+        print(f"{name:<24} {base['min'] * 1000:12.3f} {result['min'] * 1000:12.3f} "
+              f"{change:+8.1%}{mark}")
+    return regressions
+
+
+def main():
+    args = parse_arguments()
+    root = prepare_tree(args)
+
+    # Вывод команд идет в /dev/null через обычный StreamSink - как в пакетном режиме
+    with open(os.devnull, 'w', encoding='utf-8') as stream:
+        previous_dir = os.getcwd()
+        os.chdir(root)
+        try:
+            results = run_benchmarks(root, args, emu.StreamSink(stream))
+        finally:
+            os.chdir(previous_dir)
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'tree': tree_params(args),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"Базовая линия сохранена в {args.baseline}", file=sys.stderr)
+        return 0
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"Базовой линии {args.baseline} нет: запустите с --save-baseline", file=sys.stderr)
+        return 0
+
+    if baseline.get('meta', {}).get('tree') != report['meta']['tree']:
+        print("Внимание: базовая линия снята на дереве с другими параметрами", file=sys.stderr)
+    regressions = compare(results, baseline['results'], args.threshold)
+    if regressions:
+        print(f"\nЗамедлились: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,36 @@
 import shlex
 import os
-import tkinter as tk
-from tkinter import scrolledtext
+import sys
+import getpass
 import argparse
+import importlib.util
+import codecs
+import json
 import stat
 import datetime
+import queue
+import threading
+import bisect
+import fnmatch
+import heapq
+import mmap
+import re
+import struct
+import time
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_username():
+    """Возвращает имя текущего пользователя (os.getlogin не работает без терминала)"""
+    try:
+        return os.getlogin()
+    except OSError:
+        return getpass.getuser()
+
 
-vfs_name = os.getlogin()
+vfs_name = sys.intern(get_username())
 exit_cmd = "exit"
 
 # Глобальные переменные для конфигурации
@@ -15,18 +39,45 @@ startup_script = None
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 
+def insert_sorted(order, name):
+    """Вставляет имя в отсортированный список order
+
+    Директории обычно читаются по порядку имен, поэтому сначала проверяем
+    самый частый случай - имя больше всех и просто дописывается в конец."""
+    if not order or order[-1] < name:
+        order.append(name)
+    else:
+        bisect.insort(order, name)
+
+
 # VFS структуры
 class VFSNode:
+    # __slots__ вместо __dict__ - на больших деревьях узлов миллионы
+    __slots__ = ('name', 'is_directory', 'content', 'children', 'parent',
+                 'owner', 'group', 'source', 'pending', 'size', 'mtime', 'inode', 'path', 'lines',
+                 'order')
+
     def __init__(self, name, is_directory=True, content=None, owner=None, group=None):
         self.name = name
         self.is_directory = is_directory
-        self.content = content if content else ({} if is_directory else '')
+        self.content = None if is_directory else (content or '')  # Текст файла (у директорий - None)
         self.children = {} if is_directory else None
+        self.order = [] if is_directory else None  # Имена детей по возрастанию (см. insert_sorted)
         self.parent = None
-        self.owner = owner if owner else vfs_name  # По умолчанию - текущий пользователь
-        self.group = group if group else "users"   # По умолчанию - группа users
+        # Владельцы повторяются во всех узлах - храним одну копию строки
+        self.owner = sys.intern(owner) if owner else vfs_name  # По умолчанию - текущий пользователь
+        self.group = sys.intern(group) if group else "users"   # По умолчанию - группа users
+        self.source = None    # Откуда загружен узел: путь в реальной ФС или номер записи образа
+        self.pending = False  # Содержимое директории еще не прочитано (ленивая загрузка)
+        self.size = None      # Размер файла в реальной ФС (содержимое читается по требованию)
+        self.mtime = None     # st_mtime_ns в реальной ФС на момент загрузки
+        self.inode = None     # st_ino директории в реальной ФС (для vfs-reload)
+        self.path = None      # Абсолютный путь в VFS, вычисляется при добавлении в дерево
+        self.lines = None     # Смещения начал строк содержимого (см. VFS.get_line_index)
 
     def get_path(self):
+        if self.path is not None:
+            return self.path
         path_parts = []
         current = self
         while current and current.name:
@@ -35,12 +86,430 @@ class VFSNode:
         return '/' + '/'.join(reversed(path_parts))
 
 
+class ContentCache:
+    """LRU-кэш содержимого файлов VFS с ограничением объема в байтах"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # узел -> содержимое
+        self.used_bytes = 0
+
+    def get(self, node):
+        content = self.entries.get(node)
+        if content is not None:
+            self.entries.move_to_end(node)
+        return content
+
+    def put(self, node, content):
+        size = sys.getsizeof(content)
+        if size > self.max_bytes:
+            # Файл больше всего бюджета - не вытесняем ради него остальные
+            return
+        self.discard(node)
+        self.entries[node] = content
+        self.used_bytes += size
+        while self.used_bytes > self.max_bytes:
+            evicted_node, evicted = self.entries.popitem(last=False)
+            self.used_bytes -= sys.getsizeof(evicted)
+            evicted_node.lines = None
+
+    def discard(self, node):
+        # Индекс строк строится по закэшированному тексту и удаляется вместе с ним
+        node.lines = None
+        content = self.entries.pop(node, None)
+        if content is not None:
+            self.used_bytes -= sys.getsizeof(content)
+
+    def clear(self):
+        for node in self.entries:
+            node.lines = None
+        self.entries.clear()
+        self.used_bytes = 0
+
+
+class TrigramIndex:
+    """Триграммный индекс содержимого файлов VFS для vfs-grep
+
+    Файлы нумеруются, для каждой триграммы (в нижнем регистре) хранится
+    array номеров файлов, в которых она встречается. Для литеральной строки
+    кандидатами будут файлы, содержащие все ее триграммы. Удаленные файлы
+    помечаются None в paths. Пути из dirty (новые и измененные файлы) еще не
+    проиндексированы и всегда считаются кандидатами.
+    """
+
+    def __init__(self):
+        self.paths = []      # номер файла -> путь (None - файл удален)
+        self.doc_ids = {}    # путь -> номер файла
+        self.postings = {}   # триграмма -> array('I') номеров файлов
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @staticmethod
+    def trigrams(text):
+        text = text.lower()
+        return set(map(''.join, zip(text, text[1:], text[2:])))
+
+    def add(self, path, content):
+        self.remove(path)
+        doc_id = len(self.paths)
+        self.paths.append(path)
+        self.doc_ids[path] = doc_id
+        postings = self.postings
+        for gram in self.trigrams(content):
+            ids = postings.get(gram)
+            if ids is None:
+                postings[gram] = array('I', (doc_id,))
+            else:
+                ids.append(doc_id)
+
+    def remove(self, path):
+        self.dirty.discard(path)
+        doc_id = self.doc_ids.pop(path, None)
+        if doc_id is not None:
+            self.paths[doc_id] = None
+
+    def candidates(self, literal):
+        """Пути файлов, которые могут содержать literal (без учета регистра)"""
+        lists = sorted((self.postings.get(gram, ()) for gram in self.trigrams(literal)), key=len)
+        if not lists:
+            return set(self.doc_ids) | self.dirty
+        ids = set(lists[0])
+        for other in lists[1:]:
+            if not ids:
+                break
+            ids.intersection_update(other)
+        paths = self.paths
+        return {paths[i] for i in ids if paths[i] is not None} | self.dirty
+
+    def to_bytes(self):
+        """Сериализует индекс: пути файлов, затем триграммы со списками номеров"""
+        # Номера удаленных файлов выбрасываем, остальные перенумеровываем
+        live = [path for path in self.paths if path is not None]
+        remap = None
+        if len(live) != len(self.paths):
+            remap = {}
+            for doc_id, path in enumerate(self.paths):
+                if path is not None:
+                    remap[doc_id] = len(remap)
+
+        parts = [struct.pack('<II', len(live), len(self.postings))]
+        for path in live:
+            encoded = path.encode('utf-8')
+            parts.append(struct.pack('<I', len(encoded)))
+            parts.append(encoded)
+        for gram, ids in self.postings.items():
+            if remap is not None:
+                ids = array('I', (remap[i] for i in ids if i in remap))
+            if sys.byteorder == 'big':
+                ids = array('I', ids)
+                ids.byteswap()
+            encoded = gram.encode('utf-8')
+            parts.append(struct.pack('<HI', len(encoded), len(ids)))
+            parts.append(encoded)
+            parts.append(ids.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        index = cls()
+        doc_count, gram_count = struct.unpack_from('<II', data)
+        offset = 8
+        for doc_id in range(doc_count):
+            (length,) = struct.unpack_from('<I', data, offset)
+            offset += 4
+            path = data[offset:offset + length].decode('utf-8')
+            offset += length
+            index.paths.append(path)
+            index.doc_ids[path] = doc_id
+        for _ in range(gram_count):
+            gram_length, id_count = struct.unpack_from('<HI', data, offset)
+            offset += 6
+            gram = data[offset:offset + gram_length].decode('utf-8')
+            offset += gram_length
+            ids = array('I')
+            ids.frombytes(data[offset:offset + id_count * 4])
+            if sys.byteorder == 'big':
+                ids.byteswap()
+            offset += id_count * 4
+            index.postings[gram] = ids
+        return index
+
+
+def scan_real_directory(real_path):
+    """Читает одну реальную директорию через os.scandir
+
+    Возвращает (st_ino, st_mtime_ns директории, записи) или None, если доступа
+    нет. Записи - отсортированный список (имя, это_директория, размер, mtime)
+    без скрытых элементов. Тип берется из d_type записи, stat выполняется
+    только для файлов (ради размера и времени изменения)."""
+    entries = []
+    try:
+        dir_stat = os.stat(real_path)
+        with os.scandir(real_path) as it:
+            for entry in it:
+                # Пропускаем скрытые файлы, начинающиеся с .
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                size = 0
+                mtime = None
+                if not is_dir:
+                    try:
+                        entry_stat = entry.stat()
+                        size = entry_stat.st_size
+                        mtime = entry_stat.st_mtime_ns
+                    except OSError:
+                        pass
+                entries.append((entry.name, is_dir, size, mtime))
+    except (PermissionError, FileNotFoundError):
+        return None
+    entries.sort()
+    return dir_stat.st_ino, dir_stat.st_mtime_ns, entries
+
+
+# Образ VFS (little-endian):
+#   заголовок   IMAGE_HEADER: сигнатура, число узлов и строк, смещения секций
+#   строки      владельцы и группы: длина (H) + UTF-8, подряд
+#   имена       имена узлов в UTF-8, подряд
+#   содержимое  тексты файлов в UTF-8, подряд
+#   записи      IMAGE_RECORD на каждый узел: узел 0 - корень, дети одной
+#               директории идут подряд (first_child, child_count)
+#   индекс      триграммный индекс vfs-grep (TrigramIndex.to_bytes), если он построен
+IMAGE_MAGIC = b'VFSIMG02'
+IMAGE_HEADER = struct.Struct('<8sIIQQQQQQ')
+IMAGE_MAGIC_V1 = b'VFSIMG01'  # Образы без секции индекса
+IMAGE_HEADER_V1 = struct.Struct('<8sIIQQQQ')
+IMAGE_RECORD = struct.Struct('<IHHHBxIIQQ')
+IMAGE_DIRECTORY = 1
+
+
+class VFSImage:
+    """Образ VFS, открытый через mmap; записи декодируются по требованию"""
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            self.file.close()
+            raise ValueError(f"{path}: не является образом VFS")
+
+        magic = self.data[:len(IMAGE_MAGIC)]
+        if magic == IMAGE_MAGIC and len(self.data) >= IMAGE_HEADER.size:
+            (_, self.node_count, string_count, strings_offset, self.names_offset,
+             self.content_offset, self.records_offset,
+             self.index_offset, self.index_length) = IMAGE_HEADER.unpack_from(self.data)
+        elif magic == IMAGE_MAGIC_V1 and len(self.data) >= IMAGE_HEADER_V1.size:
+            (_, self.node_count, string_count, strings_offset, self.names_offset,
+             self.content_offset, self.records_offset) = IMAGE_HEADER_V1.unpack_from(self.data)
+            self.index_offset = self.index_length = 0
+        else:
+            self.close()
+            raise ValueError(f"{path}: не является образом VFS")
+
+        # Таблица владельцев/групп маленькая - читаем сразу
+        self.strings = []
+        offset = strings_offset
+        for _ in range(string_count):
+            (length,) = struct.unpack_from('<H', self.data, offset)
+            offset += 2
+            self.strings.append(sys.intern(self.data[offset:offset + length].decode('utf-8')))
+            offset += length
+
+    def make_node(self, index):
+        """Создает узел VFS по записи образа (содержимое не читается)"""
+        (name_offset, name_length, owner_id, group_id, flags,
+         _, _, _, content_length) = IMAGE_RECORD.unpack_from(
+            self.data, self.records_offset + index * IMAGE_RECORD.size)
+        start = self.names_offset + name_offset
+        name = self.data[start:start + name_length].decode('utf-8')
+
+        node = VFSNode(name, is_directory=bool(flags & IMAGE_DIRECTORY),
+                       owner=self.strings[owner_id], group=self.strings[group_id])
+        node.source = index
+        if node.is_directory:
+            node.pending = True
+        else:
+            node.size = content_length
+        return node
+
+    def children_range(self, index):
+        """Диапазон номеров записей детей директории"""
+        record = IMAGE_RECORD.unpack_from(self.data, self.records_offset + index * IMAGE_RECORD.size)
+        first_child, child_count = record[5], record[6]
+        return range(first_child, first_child + child_count)
+
+    def read_content(self, index):
+        record = IMAGE_RECORD.unpack_from(self.data, self.records_offset + index * IMAGE_RECORD.size)
+        start = self.content_offset + record[7]
+        return self.data[start:start + record[8]].decode('utf-8')
+
+    def read_index(self):
+        """Возвращает сохраненный индекс vfs-grep или None"""
+        if not self.index_length:
+            return None
+        return TrigramIndex.from_bytes(self.data[self.index_offset:self.index_offset + self.index_length])
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    @staticmethod
+    def write(vfs, path):
+        """Сохраняет все дерево VFS в образ, возвращает число узлов
+
+        Образ пишется во временный файл рядом с path и заменяет его только
+        после записи: содержимое текущей VFS может читаться через mmap из
+        того же path, и усечение файла уничтожило бы его."""
+        # Обходим дерево в ширину - так дети каждой директории получают
+        # подряд идущие номера записей
+        nodes = [vfs.root]
+        first_children = []
+        strings = {}
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            strings.setdefault(node.owner, len(strings))
+            strings.setdefault(node.group, len(strings))
+            first_children.append(len(nodes))
+            if node.is_directory:
+                vfs._ensure_loaded(node)
+                nodes.extend(node.children.values())
+            i += 1
+
+        temp_path = f"{path}.tmp{os.getpid()}"
+        try:
+            with open(temp_path, 'wb') as f:
+                VFSImage._write_sections(vfs, f, nodes, first_children, strings)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        return len(nodes)
+
+    @staticmethod
+    def _write_sections(vfs, f, nodes, first_children, strings):
+        """Записывает заголовок, строки, имена, содержимое, записи и индекс образа"""
+        f.write(b'\0' * IMAGE_HEADER.size)
+
+        strings_offset = f.tell()
+        for string in strings:
+            encoded = string.encode('utf-8')
+            f.write(struct.pack('<H', len(encoded)))
+            f.write(encoded)
+
+        names_offset = f.tell()
+        name_spans = []
+        position = 0
+        for node in nodes:
+            encoded = node.name.encode('utf-8')
+            f.write(encoded)
+            name_spans.append((position, len(encoded)))
+            position += len(encoded)
+
+        content_offset = f.tell()
+        content_spans = []
+        position = 0
+        for node in nodes:
+            if node.is_directory:
+                content_spans.append((0, 0))
+                continue
+            encoded = vfs.get_content(node).encode('utf-8')
+            f.write(encoded)
+            content_spans.append((position, len(encoded)))
+            position += len(encoded)
+
+        records_offset = f.tell()
+        records = bytearray(IMAGE_RECORD.size * len(nodes))
+        for i, node in enumerate(nodes):
+            IMAGE_RECORD.pack_into(
+                records, i * IMAGE_RECORD.size,
+                name_spans[i][0], name_spans[i][1],
+                strings[node.owner], strings[node.group],
+                IMAGE_DIRECTORY if node.is_directory else 0,
+                first_children[i], len(node.children) if node.is_directory else 0,
+                content_spans[i][0], content_spans[i][1])
+        f.write(records)
+
+        index_offset = f.tell()
+        if vfs.grep_index is not None:
+            vfs.refresh_grep_index()
+            f.write(vfs.grep_index.to_bytes())
+        index_length = f.tell() - index_offset
+
+        f.seek(0)
+        f.write(IMAGE_HEADER.pack(IMAGE_MAGIC, len(nodes), len(strings), strings_offset,
+                                  names_offset, content_offset, records_offset,
+                                  index_offset, index_length))
+
+
 class VFS:
     def __init__(self):
-        self.root = VFSNode("", is_directory=True)
-        self.current_dir = self.root
+        self.path_index = {}  # Абсолютный путь -> узел, для всех загруженных узлов
+        self.name_index = {}  # Имя -> узел или список узлов с этим именем
+        self.grep_index = None  # TrigramIndex, строится при первом vfs-grep
+        self._set_root(VFSNode("", is_directory=True))
         self.loaded = False
         self.loaded_items_count = 0
+        self.lazy = False
+        self.loaded_dirs_count = 0
+        self.pending_dirs_count = 0
+        self.content_cache = ContentCache(64 * 1024 * 1024)
+        self.workers = 8  # Потоков для чтения директорий при полной загрузке
+        self.image = None  # Открытый образ VFS, если дерево загружено из него
+
+    def _set_root(self, root):
+        """Делает узел корнем VFS и сбрасывает индекс путей"""
+        root.path = '/'
+        self.root = root
+        self.current_dir = root
+        self.path_index = {'/': root}
+        self.name_index = {}
+        self.grep_index = None
+
+    def _attach(self, parent, node, indexed=False):
+        """Добавляет узел в директорию parent и в индекс путей
+
+        indexed - содержимое узла уже есть в индексе vfs-grep (узел из
+        образа с сохраненным индексом), переиндексировать его не нужно."""
+        node.parent = parent
+        node.path = ('' if parent is self.root else parent.path) + '/' + node.name
+        if node.name not in parent.children:
+            insert_sorted(parent.order, node.name)
+        parent.children[node.name] = node
+        self.path_index[node.path] = node
+        self._index_name(node)
+        if self.grep_index is not None and not node.is_directory and not indexed:
+            self.grep_index.dirty.add(node.path)
+
+    def _index_name(self, node):
+        """Добавляет узел в индекс имен"""
+        entry = self.name_index.get(node.name)
+        if entry is None:
+            self.name_index[node.name] = node
+        elif entry.__class__ is list:
+            entry.append(node)
+        else:
+            self.name_index[node.name] = [entry, node]
+
+    def _unindex_name(self, node):
+        """Удаляет узел из индекса имен"""
+        entry = self.name_index[node.name]
+        if entry.__class__ is list:
+            entry.remove(node)
+            if len(entry) == 1:
+                self.name_index[node.name] = entry[0]
+        else:
+            del self.name_index[node.name]
 
     def load_from_directory(self, real_path):
         """Загрузка VFS - если путь None, создает образцовую структуру, иначе загружает из реальной директории"""
@@ -54,8 +523,11 @@ class VFS:
             # Загружаем из реальной директории
             return self.load_from_real_directory(real_path)
 
-    def load_from_real_directory(self, real_path):
-        """Загружает VFS из реальной директории"""
+    def load_from_real_directory(self, real_path, lazy=False):
+        """Загружает VFS из реальной директории
+
+        В ленивом режиме директории читаются только при первом обращении
+        (вход, листинг, разрешение пути через них)."""
         if not real_path or not os.path.exists(real_path):
             return False
 
@@ -65,64 +537,461 @@ class VFS:
         print(f"Загружаем VFS из реальной директории: {real_path}")
 
         # Сбрасываем текущую VFS
-        self.root = VFSNode("", is_directory=True)
-        self.current_dir = self.root
+        self._close_image()
+        self._set_root(VFSNode("", is_directory=True))
+        self.root.source = real_path
         self.loaded_items_count = 0
+        self.lazy = lazy
+        self.loaded_dirs_count = 0
+        self.pending_dirs_count = 0
+        self.content_cache.clear()
 
-        # Рекурсивно загружаем структуру
         try:
-            self._load_directory_recursive(real_path, self.root)
+            if lazy:
+                # Читаем только корень, остальное - по требованию
+                self.root.pending = True
+                self.pending_dirs_count = 1
+                self._ensure_loaded(self.root)
+            else:
+                # Рекурсивно загружаем структуру
+                self._load_directory_recursive(real_path, self.root)
             self.loaded = True
             return True
         except Exception as e:
             print(f"Ошибка загрузки VFS: {e}")
             return False
 
-    def _load_directory_recursive(self, real_path, vfs_node):
-        """Рекурсивно загружает директорию в VFS"""
+    def load_from_image(self, image_path):
+        """Открывает образ VFS; узлы декодируются при первом обращении к директориям"""
         try:
-            for item_name in os.listdir(real_path):
-                # Пропускаем скрытые файлы, начинающиеся с .
-                if item_name.startswith('.'):
-                    continue
+            image = VFSImage(image_path)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка загрузки образа VFS: {e}")
+            return False
+
+        self._close_image()
+        self.image = image
+        self._set_root(image.make_node(0))
+        self.loaded_items_count = 0
+        self.lazy = True
+        self.loaded_dirs_count = 0
+        self.pending_dirs_count = 1
+        self.content_cache.clear()
+        self._ensure_loaded(self.root)
+        self.loaded = True
+        return True
 
-                real_item_path = os.path.join(real_path, item_name)
+    def save_image(self, image_path):
+        """Сохраняет VFS в образ, возвращает число узлов"""
+        return VFSImage.write(self, image_path)
 
-                if os.path.isdir(real_item_path):
-                    # Создаем директорию в VFS
-                    new_dir = VFSNode(item_name, is_directory=True)
-                    new_dir.parent = vfs_node
-                    vfs_node.children[item_name] = new_dir
-                    vfs_node.content[item_name] = new_dir
-                    self.loaded_items_count += 1
+    def _close_image(self):
+        if self.image:
+            self.content_cache.clear()
+            self.image.close()
+            self.image = None
 
-                    # Рекурсивно загружаем содержимое
-                    self._load_directory_recursive(real_item_path, new_dir)
+    def _load_directory_recursive(self, real_path, vfs_node):
+        """Загружает все дерево директории в VFS"""
+        self._load_tree([vfs_node])
+
+    def _load_tree(self, level):
+        """Загружает поддеревья директорий level
+
+        Дерево обходится по уровням: директории одного уровня читаются
+        параллельно в пуле из self.workers потоков, а узлы создаются в
+        основном потоке в порядке уровня, поэтому результат детерминирован."""
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            while level:
+                listings = pool.map(scan_real_directory, [node.source for node in level])
+                next_level = []
+                for position, (node, listing) in enumerate(zip(level, listings)):
+                    if is_cancelled():
+                        self._defer_directories(level[position:] + next_level)
+                        check_cancelled()
+                    self.loaded_dirs_count += 1
+                    next_level.extend(self._add_directory_entries(node, listing))
+                level = next_level
+
+    def _defer_directories(self, nodes):
+        """Делает непрочитанные директории отложенными (после прерванной загрузки)
+
+        VFS переходит в ленивый режим: остальное дерево прочитается при
+        обращении, как после vfs-load --lazy."""
+        print("Загрузка прервана: остальные директории будут прочитаны при обращении")
+        self.lazy = True
+        for node in nodes:
+            node.pending = True
+        self.pending_dirs_count += len(nodes)
+        self.loaded = True
+
+    def _ensure_loaded(self, node):
+        """Читает содержимое отложенной директории при первом обращении к ней"""
+        if node.pending:
+            node.pending = False
+            self.pending_dirs_count -= 1
+            self.loaded_dirs_count += 1
+            if self.image:
+                self._add_image_entries(node)
+            else:
+                self._add_directory_entries(node, scan_real_directory(node.source))
+
+    def _add_image_entries(self, vfs_node):
+        """Декодирует из образа детей директории"""
+        for index in self.image.children_range(vfs_node.source):
+            node = self.image.make_node(index)
+            # Индекс vfs-grep к этому моменту либо сохранен в образе, либо построен
+            # обходом всего дерева - в обоих случаях файл в нем уже есть
+            self._attach(vfs_node, node, indexed=True)
+            self.loaded_items_count += 1
+            if node.is_directory:
+                self.pending_dirs_count += 1
+
+    def _add_directory_entries(self, vfs_node, listing):
+        """Создает узлы по результату scan_real_directory, возвращает новые поддиректории"""
+        if listing is None:
+            print(f"Нет доступа к: {vfs_node.source}")
+            return []
+
+        vfs_node.inode, vfs_node.mtime, entries = listing
+        subdirs = []
+        children = vfs_node.children
+        path_index = self.path_index
+        index_name = self._index_name
+        prefix = os.path.join(vfs_node.source, '')  # Путь с завершающим разделителем
+        vfs_prefix = ('' if vfs_node is self.root else vfs_node.path) + '/'
+        for item_name, is_dir, size, mtime in entries:
+            real_item_path = prefix + item_name
+
+            # То же, что _attach, но без вызова метода на каждый элемент
+            if is_dir:
+                # Создаем директорию в VFS
+                new_dir = VFSNode(item_name, is_directory=True)
+                new_dir.parent = vfs_node
+                new_dir.source = real_item_path
+                new_dir.path = vfs_prefix + item_name
+                children[item_name] = new_dir
+                path_index[new_dir.path] = new_dir
+                index_name(new_dir)
+
+                if self.lazy:
+                    new_dir.pending = True
+                    self.pending_dirs_count += 1
+                subdirs.append(new_dir)
+            else:
+                # Создаем файл в VFS - содержимое прочитаем при первом обращении
+                new_file = VFSNode(item_name, is_directory=False)
+                new_file.parent = vfs_node
+                new_file.source = real_item_path
+                new_file.size = size
+                new_file.mtime = mtime
+                new_file.path = vfs_prefix + item_name
+                children[item_name] = new_file
+                path_index[new_file.path] = new_file
+                index_name(new_file)
+                if self.grep_index is not None:
+                    self.grep_index.dirty.add(new_file.path)
+
+        order = vfs_node.order
+        if order:
+            # Дочитывание при vfs-reload - вставляем новые имена на свои места
+            for entry in entries:
+                insert_sorted(order, entry[0])
+        else:
+            # scan_real_directory отдает записи уже отсортированными по имени
+            order.extend([entry[0] for entry in entries])
+
+        self.loaded_items_count += len(entries)
+        return subdirs
+
+    def reload(self):
+        """Перечитывает директории, у которых изменились mtime/inode
+
+        Дерево правится на месте: текущая директория и владельцы, заданные
+        через vfs-chown, сохраняются. Возвращает словарь счетчиков
+        added/removed/updated/rescanned."""
+        counts = {'added': 0, 'removed': 0, 'updated': 0, 'rescanned': 0}
+        stack = [self.root]
+        while stack:
+            check_cancelled()
+            node = stack.pop()
+            if node.pending:
+                # Еще не читалась - при первом обращении прочитается актуальной
+                continue
+            try:
+                dir_stat = os.stat(node.source)
+                changed = (dir_stat.st_ino, dir_stat.st_mtime_ns) != (node.inode, node.mtime)
+            except OSError:
+                changed = True
+            if changed:
+                self._rescan_directory(node, counts)
+            stack.extend(child for child in node.children.values() if child.is_directory)
+
+        # Файлы, чье содержимое уже прочитано, могли измениться без изменения директории
+        for node in list(self.content_cache.entries):
+            try:
+                file_stat = os.stat(node.source)
+            except OSError:
+                continue
+            if (file_stat.st_size, file_stat.st_mtime_ns) != (node.size, node.mtime):
+                node.size = file_stat.st_size
+                node.mtime = file_stat.st_mtime_ns
+                self._content_changed(node)
+                counts['updated'] += 1
+
+        self._fix_current_dir()
+        return counts
+
+    def _rescan_directory(self, node, counts):
+        """Сверяет детей директории с реальной ФС и правит их на месте"""
+        counts['rescanned'] += 1
+        listing = scan_real_directory(node.source)
+        entries = listing[2] if listing else []
+
+        names = {entry[0] for entry in entries}
+        for child in list(node.children.values()):
+            if child.name not in names:
+                counts['removed'] += self._remove_node(child)
+
+        new_entries = []
+        for entry in entries:
+            item_name, is_dir, size, mtime = entry
+            child = node.children.get(item_name)
+            if child is not None and child.is_directory != is_dir:
+                # Файл заменили директорией или наоборот
+                counts['removed'] += self._remove_node(child)
+                child = None
+            if child is None:
+                new_entries.append(entry)
+            elif not is_dir and (child.size, child.mtime) != (size, mtime):
+                child.size = size
+                child.mtime = mtime
+                self._content_changed(child)
+                counts['updated'] += 1
+
+        before = self.loaded_items_count
+        if listing:
+            new_dirs = self._add_directory_entries(node, (listing[0], listing[1], new_entries))
+            if not self.lazy:
+                self._load_tree(new_dirs)
+        counts['added'] += self.loaded_items_count - before
+
+    def _content_changed(self, node):
+        """Сбрасывает все, что зависит от содержимого файла"""
+        self.content_cache.discard(node)
+        if self.grep_index is not None:
+            self.grep_index.remove(node.path)
+            self.grep_index.dirty.add(node.path)
+
+    def _remove_node(self, node):
+        """Удаляет узел с поддеревом из VFS, возвращает число удаленных узлов"""
+        parent = node.parent
+        del parent.children[node.name]
+        del parent.order[bisect.bisect_left(parent.order, node.name)]
+        removed = 0
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            removed += 1
+            del self.path_index[current.path]
+            self._unindex_name(current)
+            if current.is_directory:
+                if current.pending:
+                    self.pending_dirs_count -= 1
                 else:
-                    # Создаем файл в VFS
-                    try:
-                        # Читаем только текстовые файлы
-                        if item_name.endswith(('.txt', '.py', '.md', '.html', '.css', '.js', '.json')):
-                            with open(real_item_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                content = f.read()
-                        else:
-                            content = f"Бинарный файл: {item_name}"
-                    except:
-                        content = f"Содержимое файла {item_name}"
-
-                    new_file = VFSNode(item_name, is_directory=False, content=content)
-                    new_file.parent = vfs_node
-                    vfs_node.children[item_name] = new_file
-                    vfs_node.content[item_name] = content
-                    self.loaded_items_count += 1
+                    self.loaded_dirs_count -= 1
+                stack.extend(current.children.values())
+            else:
+                self.content_cache.discard(current)
+                if self.grep_index is not None:
+                    self.grep_index.remove(current.path)
+        self.loaded_items_count -= removed
+        return removed
+
+    def find(self, start, name=None, node_type=None, size_test=None, owner=None):
+        """Генератор узлов поддерева start, подходящих под условия vfs-find
+
+        name - шаблон имени (glob), node_type - 'f' или 'd', size_test -
+        функция от размера, owner - владелец. Если задано имя и все
+        директории прочитаны, кандидаты берутся из индекса имен без обхода
+        дерева; иначе поддерево обходится с дочитыванием директорий. В обоих
+        случаях имя сравнивается с учетом регистра (fnmatchcase), а узлы
+        выдаются в одном порядке: обход в глубину, дети по возрастанию имен."""
+        # То же, что fnmatch.fnmatchcase, но шаблон компилируется один раз
+        name_match = re.compile(fnmatch.translate(name)).match if name is not None else None
+
+        def matches(node):
+            if node_type == 'f' and node.is_directory or node_type == 'd' and not node.is_directory:
+                return False
+            if owner is not None and node.owner != owner:
+                return False
+            if size_test is not None and not size_test(self.get_size(node)):
+                return False
+            return True
 
-        except PermissionError:
-            print(f"Нет доступа к: {real_path}")
+        if name is not None and not self.pending_dirs_count:
+            if any(char in name for char in '*?['):
+                names = [item for item in self.name_index if name_match(item)]
+            else:
+                names = [name] if name in self.name_index else []
+
+            prefix = '' if start is self.root else start.path
+            candidates = []
+            for matched_name in names:
+                entry = self.name_index[matched_name]
+                for node in entry if entry.__class__ is list else (entry,):
+                    if node is not start and node.path.startswith(prefix + '/'):
+                        candidates.append(node)
+            # Сортировка по частям пути совпадает с порядком обхода в глубину
+            # по именам (по целой строке '-' и '.' оказались бы раньше '/')
+            candidates.sort(key=lambda node: node.path.split('/'))
+            # Сам start проверяется отдельно, как при обходе: корня нет в индексе имен
+            if name_match(start.name):
+                candidates.insert(0, start)
+            for node in candidates:
+                if matches(node):
+                    yield node
+            return
+
+        stack = [start]
+        while stack:
+            node = stack.pop()
+            if (name is None or name_match(node.name)) and matches(node):
+                yield node
+            if node.is_directory:
+                check_cancelled()
+                self._ensure_loaded(node)
+                stack.extend(map(node.children.__getitem__, reversed(node.order)))
+
+    def get_grep_index(self):
+        """Возвращает индекс vfs-grep, при первом обращении загружая или строя его"""
+        if self.grep_index is None:
+            index = self.image.read_index() if self.image else None
+            if index is None:
+                index = TrigramIndex()
+                for node in self.find(self.root, node_type='f'):
+                    check_cancelled()
+                    index.add(node.path, self.get_content(node))
+            self.grep_index = index
+        return self.grep_index
+
+    def grep_files(self, start, literal):
+        """Файлы поддерева start, в которых может встретиться строка literal
+
+        Без literal (шаблон не литеральный или короче триграммы) возвращаются
+        все файлы поддерева. Новые файлы индексируются по ходу поиска."""
+        if literal is None:
+            yield from self.find(start, node_type='f')
+            return
+
+        if self.pending_dirs_count:
+            # Дочитываем поддерево, чтобы его файлы попали в индекс
+            for _ in self.find(start, node_type='d'):
+                pass
+
+        index = self.get_grep_index()
+        prefix = '' if start is self.root else start.path
+        # Порядок как у find (обход в глубину по именам): сортировка по частям пути
+        paths = [path for path in index.candidates(literal) if path.startswith(prefix + '/')]
+        for path in sorted(paths, key=lambda path: path.split('/')):
+            check_cancelled()
+            node = self.find_node(path)
+            if node is None or node.is_directory:
+                index.remove(path)
+                continue
+            if path in index.dirty:
+                index.add(path, self.get_content(node))
+            yield node
+
+    def refresh_grep_index(self):
+        """Индексирует новые и измененные файлы"""
+        index = self.grep_index
+        for path in list(index.dirty):
+            node = self.find_node(path)
+            if node is None or node.is_directory:
+                index.remove(path)
+            else:
+                index.add(path, self.get_content(node))
+
+    def _fix_current_dir(self):
+        """Переходит в ближайшую сохранившуюся директорию, если текущая удалена"""
+        chain = []
+        node = self.current_dir
+        while node is not None:
+            chain.append(node)
+            node = node.parent
+        if chain[-1] is not self.root:
+            self.current_dir = self.root
+            return
+        for parent, child in zip(reversed(chain), reversed(chain[:-1])):
+            if parent.children.get(child.name) is not child:
+                self.current_dir = parent
+                return
+
+    def get_content(self, node):
+        """Возвращает содержимое файла, читая его с диска при первом обращении"""
+        if node.source is None:
+            return node.content
+
+        content = self.content_cache.get(node)
+        if content is None:
+            content = self._read_file(node)
+            self.content_cache.put(node, content)
+        return content
+
+    def get_line_index(self, node, content):
+        """Смещения начал строк content (содержимого node) и конца текста
+
+        Индекс строится при первом обращении и хранится в node.lines, пока
+        содержимое не изменилось или не вытеснено из кэша. Строка i - это
+        content[index[i]:index[i + 1] - 1]; завершающий перевод строки не
+        начинает новую строку, как в readlines()."""
+        if node.lines is None:
+            index = array('Q', (0,))
+            index.extend(match.end() for match in re.finditer('\n', content))
+            if content and not content.endswith('\n'):
+                # Последняя строка без перевода строки
+                index.append(len(content) + 1)
+            if node.source is None or self.content_cache.get(node) is content:
+                node.lines = index
+            return index
+        return node.lines
+
+    def get_lines(self, node, start, stop):
+        """Строки файла с номерами start..stop-1 (с нуля) и общее число строк
+
+        Отрицательные номера отсчитываются от конца, как в срезах."""
+        content = self.get_content(node)
+        index = self.get_line_index(node, content)
+        count = len(index) - 1
+        lines = [content[index[i]:index[i + 1] - 1] for i in range(*slice(start, stop).indices(count))]
+        return lines, count
+
+    def get_size(self, node):
+        """Возвращает размер файла без чтения его содержимого"""
+        if node.size is not None:
+            return node.size
+        return len(node.content) if node.content else 0
+
+    def _read_file(self, node):
+        """Читает содержимое файла из образа или реальной ФС"""
+        if self.image:
+            return self.image.read_content(node.source)
+        try:
+            # Читаем только текстовые файлы
+            if node.name.endswith(('.txt', '.py', '.md', '.html', '.css', '.js', '.json')):
+                with open(node.source, 'r', encoding='utf-8', errors='ignore') as f:
+                    return f.read()
+            return f"Бинарный файл: {node.name}"
+        except OSError:
+            return f"Содержимое файла {node.name}"
 
     def _create_sample_structure(self):
         """Создает образцовую структуру VFS"""
-        self.root = VFSNode("", is_directory=True)
-        self.current_dir = self.root
+        self._close_image()
+        self._set_root(VFSNode("", is_directory=True))
+        self.lazy = False
+        self.pending_dirs_count = 0
 
         # Создаем тестовую структуру с 3 уровнями вложенности
         # Уровень 1
@@ -159,16 +1028,10 @@ class VFS:
         # Создаем структуру уровня 1
         for folder in folders_l1:
             folder_name = folder[:-1]
-            new_dir = VFSNode(folder_name, is_directory=True)
-            new_dir.parent = self.root
-            self.root.children[folder_name] = new_dir
-            self.root.content[folder_name] = new_dir
+            self._attach(self.root, VFSNode(folder_name, is_directory=True))
 
         for filename, content in files_l1.items():
-            new_file = VFSNode(filename, is_directory=False, content=content)
-            new_file.parent = self.root
-            self.root.children[filename] = new_file
-            self.root.content[filename] = content
+            self._attach(self.root, VFSNode(filename, is_directory=False, content=content))
 
         # Создаем структуру уровня 2
         for parent_folder, subfolders in folders_l2.items():
@@ -176,20 +1039,14 @@ class VFS:
                 parent_node = self.root.children[parent_folder]
                 for folder in subfolders:
                     folder_name = folder[:-1]
-                    new_dir = VFSNode(folder_name, is_directory=True)
-                    new_dir.parent = parent_node
-                    parent_node.children[folder_name] = new_dir
-                    parent_node.content[folder_name] = new_dir
+                    self._attach(parent_node, VFSNode(folder_name, is_directory=True))
 
         for parent_folder, file_list in files_l2.items():
             if parent_folder in self.root.children:
                 parent_node = self.root.children[parent_folder]
                 for filename in file_list:
                     content = f"Содержимое файла {filename} в папке {parent_folder}"
-                    new_file = VFSNode(filename, is_directory=False, content=content)
-                    new_file.parent = parent_node
-                    parent_node.children[filename] = new_file
-                    parent_node.content[filename] = content
+                    self._attach(parent_node, VFSNode(filename, is_directory=False, content=content))
 
         # Создаем структуру уровня 3
         for folder_path, file_list in files_l3.items():
@@ -203,11 +1060,9 @@ class VFS:
 
             for filename in file_list:
                 content = f"Содержимое файла {filename} в папке {folder_path}"
-                new_file = VFSNode(filename, is_directory=False, content=content)
-                new_file.parent = current_node
-                current_node.children[filename] = new_file
-                current_node.content[filename] = content
+                self._attach(current_node, VFSNode(filename, is_directory=False, content=content))
 
+        self.loaded_dirs_count = 1 + len(folders_l1) + sum(len(subs) for subs in folders_l2.values())
         self.loaded_items_count = (len(folders_l1) + len(files_l1) +
                                    sum(len(subs) for subs in folders_l2.values()) +
                                    sum(len(files) for files in files_l2.values()) +
@@ -231,34 +1086,38 @@ class VFS:
             target_dir = self._resolve_relative_path(path)
 
         if target_dir and target_dir.is_directory:
+            self._ensure_loaded(target_dir)
             self.current_dir = target_dir
             return True
         return False
 
     def _resolve_absolute_path(self, path):
         """Разрешает абсолютный путь в VFS"""
-        path_parts = [p for p in path.split('/') if p]
-        current = self.root
-
-        for part in path_parts:
-            if part == "..":
-                if current.parent:
-                    current = current.parent
-                continue
-            if part == ".":
-                continue
-
-            if part in current.children:
-                current = current.children[part]
-            else:
-                return None
-
-        return current
+        return self._resolve_path(self.root, path)
 
     def _resolve_relative_path(self, path):
         """Разрешает относительный путь в VFS"""
+        return self._resolve_path(self.current_dir, path)
+
+    def _resolve_path(self, start, path):
+        """Разрешает путь относительно start
+
+        Путь без '.', '..' и повторных '/' ищется одним обращением к индексу
+        путей. Если его там нет, но часть директорий еще не прочитана, или путь
+        требует нормализации, выполняется обход по узлам."""
+        if '//' not in path and '/.' not in '/' + path:
+            relative = path.strip('/')
+            if not relative:
+                return start
+            node = self.path_index.get(('' if start is self.root else start.path) + '/' + relative)
+            if node is not None or not self.pending_dirs_count:
+                return node
+        return self._walk_path(start, path)
+
+    def _walk_path(self, start, path):
+        """Разрешает путь пошаговым обходом узлов, дочитывая отложенные директории"""
         path_parts = [p for p in path.split('/') if p]
-        current = self.current_dir
+        current = start
 
         for part in path_parts:
             if part == "..":
@@ -268,6 +1127,9 @@ class VFS:
             if part == ".":
                 continue
 
+            if not current.is_directory:
+                return None
+            self._ensure_loaded(current)
             if part in current.children:
                 current = current.children[part]
             else:
@@ -275,19 +1137,45 @@ class VFS:
 
         return current
 
-    def list_directory(self, path=None):
-        """Возвращает список содержимого директории"""
-        target_dir = self.current_dir
-        if path:
-            if path.startswith("/"):
-                target_dir = self._resolve_absolute_path(path)
-            else:
-                target_dir = self._resolve_relative_path(path)
-
-        if not target_dir or not target_dir.is_directory:
-            return None
-
-        return list(target_dir.children.keys())
+    def list_page(self, directory, show_all=False, sort=None, offset=0, limit=None):
+        """Страница детей директории: (узлы, число видимых детей)
+
+        Без sort дети идут по имени: страница вырезается из directory.order
+        за O(log n + размер страницы), а скрытые имена (все они идут подряд,
+        начиная с '.') пропускаются поиском границ, без фильтрации. С sort
+        'size' или 'time' (по убыванию, при равенстве - по имени) первые
+        offset + limit узлов выбираются через heapq за O(n log k)."""
+        self._ensure_loaded(directory)
+        order = directory.order
+        children = directory.children
+        hidden_start = hidden_end = 0
+        if not show_all:
+            hidden_start = bisect.bisect_left(order, '.')
+            hidden_end = bisect.bisect_left(order, '/', hidden_start)
+        total = len(order) - (hidden_end - hidden_start)
+        stop = total if limit is None else min(total, offset + limit)
+        if offset >= stop:
+            return [], total
+
+        if sort is None:
+            # Видимые имена - order[:hidden_start] и order[hidden_end:]
+            names = order[offset:min(stop, hidden_start)] if offset < hidden_start else []
+            first = max(offset, hidden_start) + hidden_end - hidden_start
+            names += order[first:stop + hidden_end - hidden_start]
+            return [children[name] for name in names], total
+
+        if sort == 'size':
+            def key(node):
+                return 0 if node.is_directory else -self.get_size(node), node.name
+        else:
+            def key(node):
+                return -(node.mtime or 0), node.name
+        nodes = (node for name, node in children.items() if show_all or not name.startswith('.'))
+        if limit is None:
+            ranked = sorted(nodes, key=key)
+        else:
+            ranked = heapq.nsmallest(stop, nodes, key=key)
+        return ranked[offset:stop], total
 
     def get_file_content(self, path):
         """Возвращает содержимое файла по указанному пути"""
@@ -302,7 +1190,7 @@ class VFS:
         if target_node.is_directory:
             return None  # Это директория, а не файл
 
-        return target_node.content
+        return self.get_content(target_node)
 
     def get_current_path(self):
         """Возвращает текущий путь в VFS"""
@@ -321,9 +1209,9 @@ class VFS:
         if not node:
             return False
 
-        node.owner = owner
+        node.owner = sys.intern(owner)
         if group:
-            node.group = group
+            node.group = sys.intern(group)
         return True
 
 # Глобальный объект VFS
@@ -332,10 +1220,882 @@ vfs = VFS()
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Terminal Emulator')
     parser.add_argument('--vfs-path', help='Путь к физическому расположению VFS')
+    parser.add_argument('--vfs-image', metavar='IMAGE',
+                        help='Загрузить VFS из бинарного образа (см. vfs-save)')
+    parser.add_argument('--vfs-lazy', action='store_true',
+                        help='Читать директории VFS только при первом обращении к ним')
+    parser.add_argument('--vfs-workers', type=int, default=8, metavar='N',
+                        help='Число потоков для чтения директорий при загрузке VFS')
+    parser.add_argument('--vfs-cache-mb', type=int, default=64, metavar='MB',
+                        help='Объем кэша содержимого файлов VFS, МБ')
     parser.add_argument('--startup-script', help='Путь к стартовому скрипту')
+    parser.add_argument('--precompile', action='append', default=[], metavar='DIR',
+                        help='Заранее разобрать все скрипты (*.txt) директории')
+    parser.add_argument('--plugin', action='append', default=[], metavar='FILE',
+                        help='Загрузить файл с дополнительными командами (можно несколько раз)')
+    parser.add_argument('--batch', metavar='SCRIPT',
+                        help='Выполнить скрипт без графического интерфейса ("-" - читать команды из stdin)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Файл для вывода в режиме --batch (по умолчанию stdout)')
+    parser.add_argument('--flush-interval', type=int, default=16, metavar='MS',
+                        help='Интервал сброса вывода в окно, мс (0 - при простое Tk)')
+    parser.add_argument('--flush-batch', type=int, default=500, metavar='N',
+                        help='Максимум строк, накапливаемых до принудительного сброса')
+    parser.add_argument('--scrollback', type=int, default=10000, metavar='N',
+                        help='Сколько строк вывода хранить в окне (0 - без ограничения)')
+    parser.add_argument('--scrollback-log', metavar='FILE',
+                        help='Файл, в который сохраняется вытесненная из окна история')
+    parser.add_argument('--virtual-output', action='store_true',
+                        help='Виртуализированное окно вывода для очень больших объемов текста')
+    parser.add_argument('--profile', action='store_true',
+                        help='Замерять время разбора, выполнения и вывода каждой команды (см. stats)')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='При выходе сохранить замеры в файл (включает --profile)')
+    parser.add_argument('--profile-format', choices=('trace', 'json'), default='trace',
+                        help='Формат --profile-output: Chrome trace или JSON')
     return parser.parse_args()
 
 
+# === ВЫВОД ===
+
+class StreamSink:
+    """Вывод в текстовый поток (stdout или открытый файл)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(f"{text}\n")
+
+    def flush(self):
+        self.stream.flush()
+
+
+class ListSink:
+    """Вывод в список строк в памяти"""
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, text):
+        self.lines.append(text)
+
+    def flush(self):
+        pass
+
+
+class ScrollbackArchiver:
+    """Фоновая запись вытесненной из окна истории вывода в лог-файл"""
+
+    def __init__(self, path):
+        # Файл открываем сразу, чтобы ошибка пути была видна при запуске
+        self.file = open(path, 'a', encoding='utf-8')
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, text):
+        self.queue.put(text)
+
+    def _run(self):
+        while True:
+            text = self.queue.get()
+            if text is None:
+                break
+            self.file.write(text)
+            if self.queue.empty():
+                self.file.flush()
+        self.file.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class TextWidgetSink:
+    """Буферизованный вывод в текстовый виджет Tk
+
+    Строки копятся в буфере и попадают в виджет одной вставкой: сброс
+    планируется через after (или after_idle при нулевом интервале),
+    а при накоплении max_batch строк выполняется сразу.
+
+    Если задан scrollback, в виджете хранится не больше scrollback строк.
+    Старые строки удаляются пачками по ~10% лимита, поэтому удаление
+    в среднем не зависит от объема вывода; удаленный текст передается
+    в archive (ScrollbackArchiver), если он указан.
+    """
+
+    def __init__(self, widget, flush_interval=16, max_batch=500, scrollback=0, archive=None):
+        self.widget = widget
+        self.flush_interval = flush_interval  # мс между сбросами
+        self.max_batch = max_batch
+        self.scrollback = scrollback
+        self.archive = archive
+        self.pending = []
+        self.flush_scheduled = False
+        self.line_count = 0
+
+    def write(self, text):
+        self.pending.append(text)
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+            # Перерисовываем окно один раз на пачку строк, а не на каждую строку
+            self.widget.update_idletasks()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            if self.flush_interval > 0:
+                self.widget.after(self.flush_interval, self._scheduled_flush)
+            else:
+                self.widget.after_idle(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self.flush_scheduled = False
+        self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = '\n'.join(self.pending) + '\n'
+        self.pending = []
+
+        # Строковые значения констант tk.NORMAL/tk.DISABLED/tk.END,
+        # чтобы модуль можно было использовать без импорта tkinter
+        self.widget.config(state='normal')
+        self.widget.insert('end', text)
+        self.line_count += text.count('\n')
+        if self.scrollback and self.line_count > self.scrollback + max(self.scrollback // 10, 1):
+            self._trim()
+        self.widget.config(state='disabled')
+        self.widget.see('end')
+
+    def _trim(self):
+        """Удаляет из начала виджета строки сверх лимита scrollback"""
+        excess = self.line_count - self.scrollback
+        end_index = f"{excess + 1}.0"
+        if self.archive:
+            self.archive.write(self.widget.get('1.0', end_index))
+        self.widget.delete('1.0', end_index)
+        self.line_count -= excess
+
+    def close(self):
+        """Сбрасывает буфер и дописывает оставшийся в окне текст в архив"""
+        self.flush()
+        if self.archive:
+            self.archive.write(self.widget.get('1.0', 'end-1c'))
+            self.archive.close()
+
+
+class LineStore:
+    """Компактное хранилище строк вывода
+
+    Все строки лежат в одном bytearray (UTF-8, каждая с завершающим \\n),
+    offsets[i] - смещение начала строки i, последний элемент - конец данных.
+    Ограничение limit и архив работают так же, как scrollback в TextWidgetSink.
+    """
+
+    def __init__(self, limit=0, archive=None):
+        self.data = bytearray()
+        self.offsets = array('Q', [0])
+        self.limit = limit
+        self.archive = archive
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def extend(self, texts):
+        """Добавляет строки (каждая может содержать переводы строк)"""
+        chunk = ('\n'.join(texts) + '\n').encode('utf-8')
+        base = len(self.data)
+        self.data += chunk
+        pos = chunk.find(b'\n')
+        while pos != -1:
+            self.offsets.append(base + pos + 1)
+            pos = chunk.find(b'\n', pos + 1)
+
+        if self.limit and len(self) > self.limit + max(self.limit // 10, 1):
+            self._trim(len(self) - self.limit)
+
+    def _trim(self, count):
+        """Удаляет первые count строк, передавая их в архив"""
+        cut = self.offsets[count]
+        if self.archive:
+            self.archive.write(self.data[:cut].decode('utf-8'))
+        del self.data[:cut]
+        self.offsets = array('Q', [offset - cut for offset in self.offsets[count:]])
+
+    def lines(self, start, end):
+        """Возвращает строки с номерами [start, end)"""
+        end = min(end, len(self))
+        if start >= end:
+            return []
+        text = self.data[self.offsets[start]:self.offsets[end] - 1].decode('utf-8')
+        return text.split('\n')
+
+    def find(self, pattern, start=0):
+        """Номер первой строки начиная со start, содержащей pattern, или None"""
+        if start >= len(self):
+            return None
+        pos = self.data.find(pattern.encode('utf-8'), self.offsets[start])
+        if pos == -1:
+            return None
+        return bisect.bisect_right(self.offsets, pos) - 1
+
+    def close(self):
+        if self.archive:
+            self.archive.write(self.data.decode('utf-8'))
+            self.archive.close()
+
+
+class VirtualOutputView:
+    """Окно вывода, показывающее только видимые строки LineStore
+
+    В виджете Text всегда лежат лишь строки, попадающие в окно, поэтому
+    прокрутка, поиск и переход в конец стоят O(видимых строк) независимо
+    от объема накопленного вывода.
+    """
+
+    def __init__(self, parent, store, **text_options):
+        import tkinter as tk
+        from tkinter import font as tkfont
+
+        self.store = store
+        self.frame = tk.Frame(parent, bg=text_options.get('bg', 'black'))
+        self.text = tk.Text(self.frame, wrap=tk.NONE, state=tk.DISABLED, **text_options)
+        self.scrollbar = tk.Scrollbar(self.frame, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.text.tag_configure('match', background='yellow', foreground='black')
+
+        self.line_height = tkfont.Font(font=self.text['font']).metrics('linespace')
+        self.top = 0           # номер первой видимой строки
+        self.follow = True     # держать окно в конце вывода
+        self.match_line = None
+
+        self.text.bind('<Configure>', lambda event: self.render())
+        self.text.bind('<MouseWheel>', lambda event: self.scroll(-3 if event.delta > 0 else 3))
+        self.text.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.text.bind('<Button-5>', lambda event: self.scroll(3))
+
+    def pack(self, **options):
+        self.frame.pack(**options)
+
+    def rows(self):
+        """Число строк, помещающихся в окно"""
+        height = self.text.winfo_height()
+        if height <= 1:
+            # Окно еще не отрисовано - берем высоту из настроек виджета
+            return int(self.text['height'])
+        return max(1, height // self.line_height)
+
+    def render(self):
+        rows = self.rows()
+        total = len(self.store)
+        last_top = max(0, total - rows)
+        self.top = last_top if self.follow else max(0, min(self.top, last_top))
+
+        lines = self.store.lines(self.top, self.top + rows)
+        self.text.config(state='normal')
+        self.text.delete('1.0', 'end')
+        self.text.insert('1.0', '\n'.join(lines))
+        if self.match_line is not None and self.top <= self.match_line < self.top + rows:
+            row = self.match_line - self.top + 1
+            self.text.tag_add('match', f"{row}.0", f"{row}.end")
+        self.text.config(state='disabled')
+
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + rows) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_to(self, top):
+        rows = self.rows()
+        self.top = max(0, min(top, len(self.store) - rows))
+        self.follow = self.top >= len(self.store) - rows
+        self.render()
+
+    def scroll(self, count, what='units'):
+        step = self.rows() if what == 'pages' else 1
+        self.scroll_to(self.top + count * step)
+
+    def yview(self, *args):
+        """Обработчик команд полосы прокрутки"""
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * len(self.store)))
+        elif args[0] == 'scroll':
+            self.scroll(int(args[1]), args[2])
+
+    def see_end(self):
+        self.follow = True
+        self.render()
+
+    def search(self, pattern):
+        """Переходит к следующей строке с pattern (по кругу); True, если найдена"""
+        if not pattern:
+            return False
+        start = self.top if self.match_line is None else self.match_line + 1
+        line = self.store.find(pattern, start)
+        if line is None:
+            line = self.store.find(pattern, 0)
+        if line is None:
+            return False
+        self.match_line = line
+        self.scroll_to(line - self.rows() // 2)
+        return True
+
+
+class VirtualViewSink(TextWidgetSink):
+    """Буферизованный вывод в VirtualOutputView"""
+
+    def __init__(self, view, flush_interval=16, max_batch=500):
+        super().__init__(view.text, flush_interval, max_batch)
+        self.view = view
+
+    def flush(self):
+        if not self.pending:
+            return
+        self.view.store.extend(self.pending)
+        self.pending = []
+        self.view.render()
+
+    def close(self):
+        self.flush()
+        self.view.store.close()
+
+
+class QueueSink:
+    """Потокобезопасный приемник для вывода фоновых заданий
+
+    Потоки заданий только кладут строки в очередь, а в целевой приемник
+    (виджет Tk или поток) их переносит drain() из главного потока."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.queue = queue.Queue()
+
+    def write(self, text):
+        self.queue.put(text)
+
+    def flush(self):
+        pass
+
+    def drain(self, limit=1000, timeout=None):
+        """Переносит накопленные строки в sink, возвращает их число
+
+        С timeout первая строка ожидается не дольше timeout секунд."""
+        count = 0
+        try:
+            if timeout is not None:
+                self.sink.write(self.queue.get(timeout=timeout))
+                count += 1
+            while count < limit:
+                self.sink.write(self.queue.get_nowait())
+                count += 1
+        except queue.Empty:
+            pass
+        return count
+
+
+# === ФОНОВЫЕ ЗАДАНИЯ ===
+
+class CommandCancelled(BaseException):
+    """Команда прервана (kill или Ctrl+C)
+
+    Наследуется от BaseException, как KeyboardInterrupt, чтобы обработчики
+    "except Exception" в командах не глушили отмену."""
+
+
+# Событие отмены команды, выполняемой в текущем потоке (см. check_cancelled)
+cancel_state = threading.local()
+
+
+def is_cancelled():
+    """Прервана ли команда текущего потока (без исключения, см. check_cancelled)"""
+    event = getattr(cancel_state, 'event', None)
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    """Точка отмены: бросает CommandCancelled, если текущую команду прервали
+
+    Вызывается в циклах загрузчиков VFS, поиска, cat и скриптов. В главном
+    потоке и в пакетном режиме события нет - проверка ничего не делает."""
+    if is_cancelled():
+        raise CommandCancelled()
+
+
+class Job:
+    """Фоновое задание: команда окна или поток слежения (tail -f)"""
+
+    def __init__(self, job_id, command, state='Running'):
+        self.id = job_id
+        self.command = command
+        self.state = state
+        self.threaded = False  # Отдельный поток (tail -f), а не команда рабочего потока
+        self.stop_event = threading.Event()
+        self.done = threading.Event()
+
+    def is_alive(self):
+        return not self.done.is_set()
+
+
+class JobManager:
+    """Таблица фоновых заданий
+
+    Задания двух видов: потоки с функцией target(stop_event, output_func,
+    *args) (tail -f, см. start) и команды окна, которые по очереди
+    выполняет один рабочий поток (см. submit) - команды работают с общей
+    VFS, поэтому параллельно их не запускаем. Вывод всех заданий идет
+    через общий QueueSink, который главный поток периодически переносит
+    в настоящий приемник (см. attach)."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.lock = threading.Lock()   # tail -f запускается и из рабочего потока
+        self.next_id = 1
+        self.output = QueueSink(StreamSink(sys.stdout))
+        self.commands = queue.Queue()  # очередь команд рабочего потока
+        self.worker = None
+        self.current = None            # выполняемая рабочим потоком команда
+        self.running = threading.Lock()  # занят, пока рабочий поток выполняет команду
+        self.exit_requested = False    # команда из очереди вернула "exit"
+
+    def attach(self, sink):
+        """Направляет вывод заданий в sink"""
+        self.output = QueueSink(sink)
+        return self.output
+
+    def _new_job(self, command, state='Running'):
+        with self.lock:
+            # Номера переиспользуются, когда все задания завершены, как в shell
+            if not self._prune():
+                self.next_id = 1
+            job = Job(self.next_id, command, state)
+            self.next_id += 1
+            self.jobs[job.id] = job
+        return job
+
+    def start(self, command, target, *args):
+        """Запускает target в отдельном потоке"""
+        job = self._new_job(command)
+        job.threaded = True
+        output_func = self.output.write
+
+        def run():
+            try:
+                target(job.stop_event, output_func, *args)
+            finally:
+                job.done.set()
+
+        threading.Thread(target=run, daemon=True).start()
+        return job
+
+    def submit(self, command):
+        """Ставит команду в очередь рабочего потока"""
+        job = self._new_job(command, 'Queued')
+        if self.worker is None:
+            self.worker = threading.Thread(target=self._run_commands, daemon=True)
+            self.worker.start()
+        self.commands.put(job)
+        return job
+
+    def _run_commands(self):
+        while True:
+            job = self.commands.get()
+            if job.stop_event.is_set():
+                # Снято командой kill, пока ждало в очереди
+                job.done.set()
+                continue
+            with self.running:
+                job.state = 'Running'
+                self.current = job
+                cancel_state.event = job.stop_event
+                sink = self.output
+                try:
+                    if execute_command(job.command, sink) == "exit":
+                        self.exit_requested = True
+                except CommandCancelled:
+                    sink.write(f"[{job.id}]  Terminated    {job.command}")
+                except Exception as e:
+                    sink.write(f"{job.command.split()[0]}: {e}")
+                finally:
+                    cancel_state.event = None
+                    self.current = None
+                    job.done.set()
+
+    def busy(self):
+        """Есть ли выполняемые или ожидающие команды окна"""
+        return self.current is not None or not self.commands.empty()
+
+    def active(self):
+        """Незавершенные задания по возрастанию номера; завершенные удаляются"""
+        with self.lock:
+            return self._prune()
+
+    def _prune(self):
+        for job_id in [job_id for job_id, job in self.jobs.items() if not job.is_alive()]:
+            del self.jobs[job_id]
+        return sorted(self.jobs.values(), key=lambda job: job.id)
+
+    def kill(self, job_id):
+        """Останавливает задание
+
+        Ожидающая команда снимается сразу, выполняемая прервется в ближайшей
+        точке отмены (check_cancelled), поток слежения ждем до секунды."""
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job is None or not job.is_alive():
+            return None
+        job.stop_event.set()
+        if job.state == 'Queued':
+            job.done.set()
+        elif job.threaded:
+            job.done.wait(timeout=1)
+        return job
+
+    def kill_all(self):
+        return [self.kill(job.id) for job in self.active()]
+
+    def drain(self, limit=1000):
+        if not profiler.enabled:
+            self.output.drain(limit)
+            return
+        # При --profile перенос вывода в окно замеряется отдельно от команд
+        start = time.perf_counter()
+        if self.output.drain(limit):
+            profiler.add_render(start, time.perf_counter() - start)
+
+    def wait(self):
+        """Ждет завершения всех заданий, перенося их вывод; Ctrl+C останавливает их"""
+        try:
+            while self.active():
+                self.output.drain(timeout=0.1)
+        except KeyboardInterrupt:
+            self.kill_all()
+        self.output.drain(limit=sys.maxsize)
+
+
+jobs = JobManager()
+JOBS_PUMP_INTERVAL = 16  # мс, период переноса вывода заданий в окно
+JOBS_PUMP_BATCH = 5000   # строк вывода за один перенос
+
+
+# === ПРОФИЛИРОВАНИЕ ===
+
+PROFILE_LIMIT = 100000   # Сколько последних замеров хранит профилировщик
+RENDER_EVENT = '[вывод]'  # Замер переноса вывода заданий в окно (JobManager.drain)
+
+
+class CommandTiming:
+    """Замер одной команды: разбор, выполнение, вывод и процессорное время
+
+    execute включает render - время записи вывода команды в приемник."""
+    __slots__ = ('command', 'line', 'start', 'parse', 'execute', 'render', 'cpu', 'bytes',
+                 'thread')
+
+    def __init__(self, argv, start, parse=0.0):
+        self.command = argv[0]
+        self.line = ' '.join(argv)
+        self.start = start    # Секунды от запуска профилировщика
+        self.parse = parse
+        self.execute = 0.0
+        self.render = 0.0
+        self.cpu = 0.0        # time.thread_time выполнявшего команду потока
+        self.bytes = 0
+        self.thread = threading.get_ident()
+
+    @property
+    def wall(self):
+        return self.parse + self.execute
+
+
+class TimingSink:
+    """Приемник-обертка: считает время записи и байты вывода команды"""
+
+    def __init__(self, sink, timing):
+        self.sink = sink
+        self.timing = timing
+
+    def write(self, text):
+        start = time.perf_counter()
+        self.sink.write(text)
+        timing = self.timing
+        timing.render += time.perf_counter() - start
+        timing.bytes += len(text.encode('utf-8', 'replace')) + 1  # +1 - перевод строки
+
+    def flush(self):
+        self.sink.flush()
+
+
+def percentile(values, p):
+    """p-й перцентиль отсортированного списка values (метод ближайшего ранга)"""
+    return values[max(0, (p * len(values) + 99) // 100 - 1)]
+
+
+class Profiler:
+    """Замеры команд для time, stats и --profile
+
+    Пока профилирование выключено, execute_argv не создает замеров и
+    команды выполняются без накладных расходов. Замеры добавляются из
+    рабочего потока и главного потока окна; deque.append атомарен."""
+
+    def __init__(self, limit=PROFILE_LIMIT):
+        self.enabled = False
+        self.timings = deque(maxlen=limit)
+        self.origin = time.perf_counter()
+
+    def measure(self, argv, sink, parse=0.0):
+        """Выполняет argv с замером, возвращает (результат команды, замер)"""
+        start = time.perf_counter()
+        timing = CommandTiming(argv, start - parse - self.origin, parse)
+        cpu = time.thread_time()
+        try:
+            return dispatch_argv(argv, TimingSink(sink, timing)), timing
+        finally:
+            timing.execute = time.perf_counter() - start
+            timing.cpu = time.thread_time() - cpu
+            if self.enabled:
+                self.timings.append(timing)
+
+    def add_render(self, start, duration):
+        timing = CommandTiming((RENDER_EVENT,), start - self.origin)
+        timing.execute = timing.render = duration
+        self.timings.append(timing)
+
+    def reset(self):
+        self.timings.clear()
+
+    def summary(self):
+        """Сводка по командам: число вызовов, перцентили и средние, в секундах"""
+        groups = {}
+        for timing in list(self.timings):
+            groups.setdefault(timing.command, []).append(timing)
+        rows = []
+        for command, timings in sorted(groups.items()):
+            walls = sorted(timing.wall for timing in timings)
+            count = len(timings)
+            rows.append({
+                'command': command,
+                'count': count,
+                'p50': percentile(walls, 50),
+                'p95': percentile(walls, 95),
+                'p99': percentile(walls, 99),
+                'parse': sum(timing.parse for timing in timings) / count,
+                'execute': sum(timing.execute - timing.render for timing in timings) / count,
+                'render': sum(timing.render for timing in timings) / count,
+                'cpu': sum(timing.cpu for timing in timings) / count,
+                'bytes': sum(timing.bytes for timing in timings),
+            })
+        return rows
+
+    def export_json(self, path):
+        """Сохраняет все замеры и сводку в JSON"""
+        data = {
+            'commands': [{field: getattr(timing, field) for field in CommandTiming.__slots__}
+                         for timing in list(self.timings)],
+            'summary': self.summary(),
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+
+    def export_trace(self, path):
+        """Сохраняет замеры в формате Chrome trace (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        main_thread = threading.main_thread().ident
+        events = []
+        threads = set()
+        for timing in list(self.timings):
+            threads.add(timing.thread)
+            start = timing.start * 1e6
+            base = {'ph': 'X', 'pid': pid, 'tid': timing.thread}
+            if timing.command == RENDER_EVENT:
+                events.append(dict(base, name='render', cat='output', ts=start,
+                                   dur=timing.render * 1e6))
+                continue
+            events.append(dict(base, name=timing.command, cat='command', ts=start,
+                               dur=timing.wall * 1e6,
+                               args={'line': timing.line, 'cpu_ms': timing.cpu * 1e3,
+                                     'render_ms': timing.render * 1e3, 'bytes': timing.bytes}))
+            if timing.parse:
+                events.append(dict(base, name='parse', cat='parse', ts=start,
+                                   dur=timing.parse * 1e6))
+            events.append(dict(base, name='execute', cat='execute',
+                               ts=start + timing.parse * 1e6, dur=timing.execute * 1e6))
+        for thread in threads:
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': thread,
+                           'args': {'name': 'main' if thread == main_thread else 'worker'}})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+
+    def export(self, path, fmt='trace'):
+        if fmt == 'json':
+            self.export_json(path)
+        else:
+            self.export_trace(path)
+
+
+profiler = Profiler()
+
+
+# === РЕЕСТР КОМАНД ===
+
+class Command:
+    """Описание команды эмулятора для реестра COMMANDS
+
+    handler вызывается как handler(args, output_func), а с pass_sink -
+    как handler(args, sink) (нужно командам, которые сами выполняют
+    другие команды, например скриптам). Команды с inline выполняются
+    в окне сразу, в главном потоке, а не в очереди рабочего потока -
+    так jobs и kill работают, пока выполняется долгая команда. paths
+    задает дополнение аргументов по Tab (см. complete_line).
+
+    Спецификация аргументов (проверяется до вызова handler, см.
+    check_arguments): options - короткие опции в стиле getopt ('alR',
+    'n:' - опция со значением), long_options - длинные ('lazy', 'limit='),
+    operands - (минимум, максимум или None) операндов. С options=None
+    команда разбирает аргументы сама (time, kill, vfs-find, tail -5)."""
+
+    def __init__(self, name, handler, usage='', help='', aliases=(), category='Прочие',
+                 pass_sink=False, inline=False, paths=None, options=None, long_options=(),
+                 operands=(0, None)):
+        self.name = name
+        self.handler = handler
+        self.usage = usage or name
+        self.help = help
+        self.aliases = tuple(aliases)
+        self.category = category
+        self.pass_sink = pass_sink
+        self.inline = inline
+        self.paths = paths  # Какие пути дополнять по Tab в аргументах: 'vfs', 'real' или None
+        self.options = options
+        self.long_options = tuple(long_options)
+        self.operands = operands
+
+    def describe_options(self):
+        """Опции из спецификации для help: '-a, -n ARG, --limit=ARG'"""
+        described = []
+        for i, flag in enumerate(self.options or ''):
+            if flag != ':':
+                described.append(f"-{flag} ARG" if self.options[i + 1:i + 2] == ':' else f"-{flag}")
+        for option in self.long_options:
+            described.append(f"--{option}ARG" if option.endswith('=') else f"--{option}")
+        return ', '.join(described)
+
+
+def check_arguments(command, args):
+    """Проверяет args по спецификации command, возвращает текст ошибки или None
+
+    Сообщения - как у утилит GNU. Сами значения опций и операнды проверяет
+    handler (число ли это, существует ли файл)."""
+    short = command.options
+    operands = 0
+    extra = None
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--':
+            rest = args[i + 1:]
+            if extra is None and command.operands[1] is not None and \
+                    operands + len(rest) > command.operands[1]:
+                extra = rest[command.operands[1] - operands]
+            operands += len(rest)
+            break
+        if arg.startswith('--'):
+            name, has_value, _ = arg[2:].partition('=')
+            if name + '=' in command.long_options:
+                if not has_value:
+                    if i + 1 >= len(args):
+                        return f"option '--{name}' requires an argument"
+                    i += 1
+            elif name in command.long_options:
+                if has_value:
+                    return f"option '--{name}' doesn't allow an argument"
+            else:
+                return f"unrecognized option '{arg}'"
+        elif arg.startswith('-') and len(arg) > 1:
+            for j in range(1, len(arg)):
+                flag = arg[j]
+                position = short.find(flag)
+                if flag == ':' or position < 0:
+                    return f"invalid option -- '{flag}'"
+                if short[position + 1:position + 2] == ':':
+                    # Значение - остаток слова (-n5) или следующее слово (-n 5)
+                    if j == len(arg) - 1:
+                        if i + 1 >= len(args):
+                            return f"option requires an argument -- '{flag}'"
+                        i += 1
+                    break
+        else:
+            operands += 1
+            if extra is None and command.operands[1] is not None and operands > command.operands[1]:
+                extra = arg
+        i += 1
+    if operands < command.operands[0]:
+        return "missing operand"
+    if extra is not None:
+        return f"extra operand '{extra}'"
+    return None
+
+
+COMMANDS = {}         # имя или псевдоним -> Command
+COMMAND_ORDER = []    # команды в порядке регистрации (для help)
+COMMAND_NAMES = []    # имена и псевдонимы по возрастанию (для дополнения по Tab)
+
+
+def register_command(name, handler=None, usage='', help='', aliases=(), category='Прочие',
+                     pass_sink=False, replace=False, inline=False, paths=None, options=None,
+                     long_options=(), operands=(0, None)):
+    """Регистрирует команду; без handler работает как декоратор
+
+    Плагины (см. load_plugin) вызывают ее как emu.register_command. Занятое
+    имя или псевдоним можно перехватить только с replace=True. Про options,
+    long_options и operands см. Command."""
+    if handler is None:
+        def decorator(function):
+            register_command(name, function, usage, help, aliases, category, pass_sink, replace,
+                             inline, paths, options, long_options, operands)
+            return function
+        return decorator
+
+    command = Command(name, handler, usage, help, aliases, category, pass_sink, inline, paths,
+                      options, long_options, operands)
+    if not replace:
+        for key in (name,) + command.aliases:
+            if key in COMMANDS:
+                raise ValueError(f"command '{key}' is already registered")
+    old = COMMANDS.get(name)
+    if old is not None and old.name == name:
+        # Перерегистрация: новая команда занимает место старой в help
+        COMMAND_ORDER[COMMAND_ORDER.index(old)] = command
+        for alias in old.aliases:
+            if COMMANDS.get(alias) is old:
+                del COMMANDS[alias]
+                del COMMAND_NAMES[bisect.bisect_left(COMMAND_NAMES, alias)]
+    else:
+        COMMAND_ORDER.append(command)
+    for key in (name,) + command.aliases:
+        if key not in COMMANDS:
+            insert_sorted(COMMAND_NAMES, key)
+        COMMANDS[key] = command
+    return handler
+
+
+def load_plugin(path):
+    """Загружает файл расширения, который регистрирует свои команды
+
+    Плагин пишет `import emu` и вызывает emu.register_command. При запуске
+    emu.py как скрипта модуль называется __main__, поэтому регистрируем его
+    и под именем emu - иначе import создал бы вторую копию с пустым реестром."""
+    sys.modules.setdefault('emu', sys.modules[__name__])
+    module_name = 'emu_plugin_' + os.path.splitext(os.path.basename(path))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    if spec is None:
+        raise ImportError(f"not a Python file: '{path}'")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
 # === КОМАНДЫ РЕАЛЬНОЙ ФАЙЛОВОЙ СИСТЕМЫ ===
 
 def do_parc(args, output_func):
@@ -384,17 +2144,94 @@ def do_vfs_chown(args, output_func):
         return
 
     # Меняем владельца
-    target_node.owner = owner
+    target_node.owner = sys.intern(owner)
     if group:
-        target_node.group = group
+        target_node.group = sys.intern(group)
 
     output_func(f"Changed ownership of '{target}' to {owner_spec} in VFS")
 
+LS_BATCH = 1000  # строк ls, передаваемых в output_func одним вызовом
+
+# Строки прав rwx для всех 512 значений mode & 0o777
+PERMISSION_STRINGS = tuple(
+    ''.join(flag if mode & (0o400 >> bit) else '-' for bit, flag in enumerate('rwxrwxrwx'))
+    for mode in range(512)
+)
+
+# Время изменения в формате ls -l по номеру минуты: у файлов одной
+# директории оно часто совпадает, а strftime дорогой
+mtime_strings = {}
+
+
+def format_mtime(mtime):
+    minute = int(mtime // 60)
+    text = mtime_strings.get(minute)
+    if text is None:
+        if len(mtime_strings) >= 65536:
+            mtime_strings.clear()
+        text = datetime.datetime.fromtimestamp(minute * 60).strftime('%Y-%m-%d %H:%M')
+        mtime_strings[minute] = text
+    return text
+
+
+def list_real_directory(path, show_all, long_format, output_func):
+    """Выводит содержимое директории path, возвращает пути ее поддиректорий
+
+    Директория читается через os.scandir: тип записи известен без stat,
+    а для -l делается один stat на запись. Строки выводятся пачками по
+    LS_BATCH. Символические ссылки на директории в результат не попадают,
+    чтобы ls -R не зацикливался."""
+    with os.scandir(path) as iterator:
+        entries = [entry for entry in iterator if show_all or not entry.name.startswith('.')]
+
+    # Сортируем - сначала директории, потом файлы
+    entries.sort(key=lambda entry: (not entry.is_dir(), entry.name))
+
+    batch = []
+    for entry in entries:
+        is_dir = entry.is_dir()
+        if long_format:
+            try:
+                try:
+                    stat_info = entry.stat()
+                except OSError:
+                    # Битая символическая ссылка - показываем саму ссылку
+                    stat_info = entry.stat(follow_symlinks=False)
+            except OSError as e:
+                # Запись удалена во время обхода или нет доступа - как в GNU ls,
+                # сообщаем об ошибке и выводим '?' вместо атрибутов
+                if batch:
+                    output_func('\n'.join(batch))
+                    batch = []
+                output_func(f"ls: cannot access '{entry.path}': {e.strerror}")
+                batch.append(f"{'d' if is_dir else '-'}?????????    ?      ?      ?        ? "
+                             f"{'?':<16} {entry.name}{'/' if is_dir else ''}")
+                continue
+            permissions = ('d' if is_dir else '-') + PERMISSION_STRINGS[stat_info.st_mode & 0o777]
+            size = '<DIR>' if is_dir else stat_info.st_size
+            batch.append(f"{permissions} {stat_info.st_nlink:>4} {stat_info.st_uid:>6} "
+                         f"{stat_info.st_gid:>6} {size:>8} {format_mtime(stat_info.st_mtime)} "
+                         f"{entry.name}{'/' if is_dir else ''}")
+        else:
+            batch.append(entry.name + '/' if is_dir else entry.name)
+        if len(batch) >= LS_BATCH:
+            output_func('\n'.join(batch))
+            batch = []
+    if batch:
+        output_func('\n'.join(batch))
+
+    return [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+
 def do_ls(args, output_func):
-    """Команда ls для реальной файловой системы с поддержкой параметров"""
+    """Команда ls для реальной файловой системы с поддержкой параметров
+
+    -R обходит поддеревья в глубину; в памяти держится только листинг
+    текущей директории и пути еще не выведенных поддиректорий."""
     # Парсим аргументы
     show_all = False
     long_format = False
+    recursive = False
     target_dir = '.'
 
     i = 0
@@ -405,89 +2242,75 @@ def do_ls(args, output_func):
                 show_all = True
             if 'l' in arg:
                 long_format = True
+            if 'R' in arg:
+                recursive = True
         else:
             target_dir = arg
         i += 1
 
-    try:
-        entries = os.listdir(target_dir)
-
-        # Фильтруем скрытые файлы если не указан -a
-        if not show_all:
-            entries = [e for e in entries if not e.startswith('.')]
-
-        # Сортируем - сначала директории, потом файлы
-        entries.sort(key=lambda x: (not os.path.isdir(os.path.join(target_dir, x)), x))
-
-        for entry in entries:
-            full_path = os.path.join(target_dir, entry)
-            if os.path.isdir(full_path):
-                if long_format:
-                    # Для директории в длинном формате
-                    stat_info = os.stat(full_path)
-                    mtime = datetime.datetime.fromtimestamp(stat_info.st_mtime).strftime('%Y-%m-%d %H:%M')
-                    permissions = get_permissions_string(stat_info)
-                    output_func(
-                        f"{permissions} {stat_info.st_nlink:>4} {stat_info.st_uid:>6} {stat_info.st_gid:>6} {'<DIR>':>8} {mtime} {entry}/")
-                else:
-                    output_func(entry + "/")
-            else:
-                if long_format:
-                    # Для файла в длинном формате
-                    stat_info = os.stat(full_path)
-                    mtime = datetime.datetime.fromtimestamp(stat_info.st_mtime).strftime('%Y-%m-%d %H:%M')
-                    size = stat_info.st_size
-                    permissions = get_permissions_string(stat_info)
-                    output_func(
-                        f"{permissions} {stat_info.st_nlink:>4} {stat_info.st_uid:>6} {stat_info.st_gid:>6} {size:>8} {mtime} {entry}")
-                else:
-                    output_func(entry)
-
-    except FileNotFoundError:
-        output_func(f"ls: cannot access '{target_dir}': No such file or directory")
-    except PermissionError:
-        output_func(f"ls: cannot open directory '{target_dir}': Permission denied")
+    stack = [target_dir]
+    first = True
+    while stack:
+        check_cancelled()
+        path = stack.pop()
+        if recursive:
+            # Как в ls -R: заголовок у каждой директории, между ними пустая строка
+            if not first:
+                output_func("")
+            output_func(f"{path}:")
+        first = False
+        try:
+            subdirs = list_real_directory(path, show_all, long_format, output_func)
+        except FileNotFoundError:
+            output_func(f"ls: cannot access '{path}': No such file or directory")
+            continue
+        except NotADirectoryError:
+            output_func(path)
+            continue
+        except PermissionError:
+            output_func(f"ls: cannot open directory '{path}': Permission denied")
+            continue
+        if recursive:
+            stack.extend(reversed(subdirs))
 
 
 def get_permissions_string(stat_info):
     """Возвращает строку прав доступа в UNIX-стиле"""
-    permissions = ''
-
-    # Тип файла
-    if stat.S_ISDIR(stat_info.st_mode):
-        permissions += 'd'
-    else:
-        permissions += '-'
-
-    # Права владельца
-    permissions += 'r' if stat_info.st_mode & stat.S_IRUSR else '-'
-    permissions += 'w' if stat_info.st_mode & stat.S_IWUSR else '-'
-    permissions += 'x' if stat_info.st_mode & stat.S_IXUSR else '-'
+    return ('d' if stat.S_ISDIR(stat_info.st_mode) else '-') + PERMISSION_STRINGS[stat_info.st_mode & 0o777]
 
-    # Права группы
-    permissions += 'r' if stat_info.st_mode & stat.S_IRGRP else '-'
-    permissions += 'w' if stat_info.st_mode & stat.S_IWGRP else '-'
-    permissions += 'x' if stat_info.st_mode & stat.S_IXGRP else '-'
-
-    # Права остальных
-    permissions += 'r' if stat_info.st_mode & stat.S_IROTH else '-'
-    permissions += 'w' if stat_info.st_mode & stat.S_IWOTH else '-'
-    permissions += 'x' if stat_info.st_mode & stat.S_IXOTH else '-'
-
-    return permissions
 
 def do_help(args, output_func):
+    """Команда help - список команд из реестра или справка по одной команде"""
+    if args:
+        command = COMMANDS.get(args[0])
+        if command is None:
+            output_func(f"help: no help topics match '{args[0]}'")
+            return
+        output_func(f"Usage: {command.usage}")
+        if command.help:
+            output_func(f"  {command.help}")
+        if command.options is not None and command.describe_options():
+            output_func(f"  Опции: {command.describe_options()}")
+        if command.aliases:
+            output_func(f"  Псевдонимы: {', '.join(command.aliases)}")
+        return
+
+    categories = {}
+    for command in COMMAND_ORDER:
+        categories.setdefault(command.category, []).append(command.name)
     output_func("Доступные команды:")
-    output_func("  Основные: ls, cd, pwd, echo, cat, tail, whoami, exit")
+    for category, names in categories.items():
+        output_func(f"  {category}: {', '.join(names)}")
     output_func("  Переменные окружения ($ЗНАЧЕНИЕ)")
-    output_func("  VFS: vfs-load, vfs-ls, vfs-cd, vfs-pwd, vfs-cat, vfs-tail, vfs-whoami, vfs-status")
-    output_func("  Скрипты: basic_commands, navigation, error_test")
-    output_func("  VFS-скрипты: vfs_deepstruct_test, vfs_error_test, vfs_all_test")
-    output_func("  Скрипт для проверки всей системы: system_test")
-    output_func("  Скрипт этапа 4: stage4_test")
-    output_func("  Скрипт этапа 5: stage5_test")
+    output_func("  Подробнее о команде: help КОМАНДА")
     output_func("")
 
+
+def do_exit(args, output_func):
+    """Команда exit - завершение эмулятора (или текущего скрипта)"""
+    return "exit"
+
+
 def do_cd(args, output_func):
     """Команда cd для реальной файловой системы"""
     if not args:
@@ -515,34 +2338,254 @@ def do_echo(args, output_func):
     output_func(' '.join(args))
 
 
+CAT_CHUNK_SIZE = 64 * 1024
+
+
+def stream_text(f, output_func, limit=None, chunk_size=CAT_CHUNK_SIZE):
+    """Выводит бинарный файл f в UTF-8 кусками по chunk_size байт
+
+    Каждый кусок обрезается по последнему переводу строки, остаток переносится
+    в следующий, поэтому в output_func попадают целые строки. Строка длиннее
+    chunk_size выводится частями, чтобы память не зависела от ее длины.
+    Читается не больше limit байт. Возвращает (прочитано байт, обрезан ли вывод)."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    carry = []
+    carry_size = 0
+    total = 0
+    while limit is None or total < limit:
+        check_cancelled()
+        data = f.read(chunk_size if limit is None else min(chunk_size, limit - total))
+        if not data:
+            break
+        total += len(data)
+        text = decoder.decode(data)
+        cut = text.rfind('\n')
+        if cut < 0:
+            carry.append(text)
+            carry_size += len(text)
+            if carry_size >= chunk_size:
+                output_func(''.join(carry))
+                carry = []
+                carry_size = 0
+            continue
+        carry.append(text[:cut])
+        output_func(''.join(carry))
+        carry = [text[cut + 1:]]
+        carry_size = len(carry[0])
+
+    truncated = limit is not None and total >= limit and bool(f.read(1))
+    if not truncated:
+        # Обрезанный символ в конце файла - ошибка, как и при f.read()
+        decoder.decode(b'', final=True)
+    tail = ''.join(carry)
+    if tail:
+        output_func(tail)
+    return total, truncated
+
+
 def do_cat(args, output_func):
-    """Команда cat для реальной файловой системы"""
-    if not args:
+    """Команда cat для реальной файловой системы
+
+    Файлы выводятся по порядку потоком кусков (см. stream_text), поэтому
+    память не зависит от их размера. --max-bytes N ограничивает общий
+    объем выводимых данных."""
+    filenames = []
+    max_bytes = None
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--max-bytes' or arg.startswith('--max-bytes='):
+            if '=' in arg:
+                value = arg.split('=', 1)[1]
+            elif i + 1 < len(args):
+                value = args[i + 1]
+                i += 1
+            else:
+                output_func("cat: option '--max-bytes' requires an argument")
+                return
+            try:
+                max_bytes = int(value)
+            except ValueError:
+                max_bytes = -1
+            if max_bytes < 0:
+                output_func(f"cat: invalid number of bytes: '{value}'")
+                return
+        else:
+            filenames.append(arg)
+        i += 1
+
+    if not filenames:
         output_func("cat: missing file operand")
         return
 
-    filename = args[0]
+    remaining = max_bytes
+    for filename in filenames:
+        try:
+            with open(filename, 'rb') as f:
+                read_bytes, truncated = stream_text(f, output_func, remaining)
+        except FileNotFoundError:
+            output_func(f"cat: {filename}: No such file or directory")
+            continue
+        except IsADirectoryError:
+            output_func(f"cat: {filename}: Is a directory")
+            continue
+        except Exception:
+            output_func(f"cat: {filename}: Error reading file")
+            continue
+
+        if remaining is not None:
+            remaining -= read_bytes
+            if truncated or (remaining == 0 and filename != filenames[-1]):
+                output_func(f"cat: output truncated at {max_bytes} bytes (--max-bytes)")
+                return
+
+
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def read_tail_lines(f, lines_count, block_size=TAIL_BLOCK_SIZE):
+    """Последние lines_count строк бинарного файла f
+
+    Файл читается блоками с конца, пока не наберется нужное число переводов
+    строки, поэтому память не зависит от размера файла. Перевод строки в UTF-8
+    не встречается внутри многобайтовых символов, так что разрез по нему
+    декодируется корректно."""
+    if lines_count <= 0:
+        return []
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    if position == 0:
+        return []
+    blocks = []
+    newlines = 0
+    trailing = None
+    while position > 0:
+        size = min(block_size, position)
+        position -= size
+        f.seek(position)
+        block = f.read(size)
+        if trailing is None:
+            # Завершающий перевод строки не начинает новую строку
+            trailing = block.endswith(b'\n')
+        blocks.append(block)
+        newlines += block.count(b'\n')
+        if newlines > lines_count - (0 if trailing else 1):
+            break
+    data = b''.join(reversed(blocks))
+    if position > 0:
+        # Отбрасываем неполную первую строку (она может резать символ)
+        data = data[data.index(b'\n') + 1:]
+    lines = data.decode('utf-8').split('\n')
+    if trailing:
+        lines.pop()
+    return lines[-lines_count:]
+
+
+def read_tail_bytes(f, bytes_count):
+    """Последние bytes_count байт бинарного файла f в виде строки
+
+    Начало сдвигается на границу символа UTF-8, чтобы не резать символ."""
+    if bytes_count <= 0:
+        return ''
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - bytes_count))
+    data = f.read(bytes_count)
+    skip = 0
+    while skip < min(3, len(data)) and 0x80 <= data[skip] < 0xC0:
+        skip += 1
+    return data[skip:].decode('utf-8')
+
+
+FOLLOW_INTERVAL = 0.25  # с, период опроса файла в tail -f
+
+
+def follow_file(stop_event, output_func, path, position, interval=FOLLOW_INTERVAL):
+    """Выводит строки, дописываемые в файл path после смещения position (tail -f)
+
+    Файл опрашивается раз в interval секунд. Уменьшение размера считается
+    усечением (чтение с начала), смена inode - ротацией: старый файл
+    дочитывается и открывается новый. Пока файла нет, ожидаем его появления."""
+    f = None
+    identity = None
+    partial = b''
+
+    def read_new():
+        nonlocal position, partial
+        f.seek(position)
+        while True:
+            data = f.read(TAIL_BLOCK_SIZE)
+            if not data:
+                break
+            position += len(data)
+            lines = (partial + data).split(b'\n')
+            partial = lines.pop()
+            if lines:
+                output_func('\n'.join(line.decode('utf-8', 'replace').rstrip() for line in lines))
+
+    def flush_partial():
+        # Последняя строка старого файла без перевода строки не теряется
+        nonlocal partial
+        if partial:
+            output_func(partial.decode('utf-8', 'replace').rstrip())
+            partial = b''
+
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            content = f.read()
-            output_func(content)
-    except FileNotFoundError:
-        output_func(f"cat: {filename}: No such file or directory")
-    except IsADirectoryError:
-        output_func(f"cat: {filename}: Is a directory")
-    except Exception as e:
-        output_func(f"cat: {filename}: Error reading file")
+        while True:
+            if f is None:
+                try:
+                    f = open(path, 'rb')
+                except OSError:
+                    f = None
+                else:
+                    info = os.fstat(f.fileno())
+                    if identity is not None:
+                        # Новый файл после ротации читаем с начала
+                        position = 0
+                    elif info.st_size < position:
+                        position = 0
+                    identity = (info.st_dev, info.st_ino)
+            if f is not None:
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    info = None
+                if info is not None and (info.st_dev, info.st_ino) != identity:
+                    read_new()
+                    f.close()
+                    f = None
+                    flush_partial()
+                    output_func(f"tail: '{path}' has been replaced; following new file")
+                    continue
+                if os.fstat(f.fileno()).st_size < position:
+                    flush_partial()
+                    output_func(f"tail: {path}: file truncated")
+                    position = 0
+                read_new()
+            if stop_event.wait(interval):
+                break
+    finally:
+        if f is not None:
+            f.close()
+
+
+def start_follow(command, path, position):
+    """Запускает tail -f в фоновом задании, возвращает сообщение о запуске"""
+    job = jobs.start(command, follow_file, path, position)
+    return f"[{job.id}] {job.command}"
 
 
 def do_tail(args, output_func):
-    """Команда tail - вывод последних строк файла"""
+    """Команда tail - вывод последних строк (или байт) файла, -f - слежение за файлом"""
     if not args:
         output_func("tail: missing file operand")
-        output_func("Usage: tail [-n LINES] FILE")
+        output_func("Usage: tail [-f] [-n LINES | -c BYTES] FILE")
         return
 
     # Параметры по умолчанию
     lines_count = 10
+    bytes_count = None
+    follow = False
     filename = None
 
     # Парсим аргументы
@@ -553,6 +2596,7 @@ def do_tail(args, output_func):
             if i + 1 < len(args):
                 try:
                     lines_count = int(args[i + 1])
+                    bytes_count = None
                     i += 1  # Пропускаем следующий аргумент (число строк)
                 except ValueError:
                     output_func(f"tail: invalid number of lines: '{args[i + 1]}'")
@@ -560,9 +2604,23 @@ def do_tail(args, output_func):
             else:
                 output_func("tail: option requires an argument -- 'n'")
                 return
+        elif arg == '-c':
+            if i + 1 < len(args):
+                try:
+                    bytes_count = int(args[i + 1])
+                    i += 1  # Пропускаем следующий аргумент (число байт)
+                except ValueError:
+                    output_func(f"tail: invalid number of bytes: '{args[i + 1]}'")
+                    return
+            else:
+                output_func("tail: option requires an argument -- 'c'")
+                return
+        elif arg == '-f':
+            follow = True
         elif arg.startswith('-') and len(arg) > 1 and arg[1:].isdigit():
             # Формат -5 (без пробела)
             lines_count = int(arg[1:])
+            bytes_count = None
         elif not arg.startswith('-'):
             filename = arg
         i += 1
@@ -572,13 +2630,21 @@ def do_tail(args, output_func):
         return
 
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            all_lines = f.readlines()
+        with open(filename, 'rb') as f:
+            # Слежение продолжается с размера файла на момент вывода хвоста
+            end = os.fstat(f.fileno()).st_size
+            if bytes_count is not None:
+                content = read_tail_bytes(f, bytes_count)
+                if content:
+                    output_func(content[:-1] if content.endswith('\n') else content)
+            else:
+                lines = read_tail_lines(f, lines_count)
+                # Выводим последние lines_count строк одним блоком
+                if lines:
+                    output_func('\n'.join(line.rstrip() for line in lines))
 
-        # Выводим последние lines_count строк
-        start_line = max(0, len(all_lines) - lines_count)
-        for line in all_lines[start_line:]:
-            output_func(line.rstrip())
+        if follow:
+            output_func(start_follow(f"tail -f {filename}", os.path.abspath(filename), end))
 
     except FileNotFoundError:
         output_func(f"tail: cannot open '{filename}' for reading: No such file or directory")
@@ -590,13 +2656,17 @@ def do_tail(args, output_func):
 
 def do_whoami(args, output_func):
     """Команда whoami - вывод текущего пользователя"""
-    output_func(os.getlogin())
+    output_func(get_username())
 
 
 # === КОМАНДЫ VFS ===
 
 def do_vfs_ls(args, output_func):
-    """Команда ls для VFS"""
+    """Команда ls для VFS
+
+    Дети выводятся по имени (-S - по размеру, -t - по времени изменения),
+    --offset/--limit выбирают страницу; стоимость зависит от размера
+    страницы, а не директории (см. VFS.list_page)."""
     if not vfs.loaded:
         output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
         return
@@ -604,48 +2674,80 @@ def do_vfs_ls(args, output_func):
     # Парсим аргументы
     show_all = False
     long_format = False
+    sort = None
+    offset = 0
+    limit = None
     target_path = None
 
     i = 0
     while i < len(args):
         arg = args[i]
-        if arg.startswith('-'):
+        if arg in ('--limit', '--offset'):
+            if i + 1 >= len(args):
+                output_func(f"vfs-ls: option '{arg}' requires an argument")
+                return
+            try:
+                value = int(args[i + 1])
+            except ValueError:
+                value = -1
+            if value < 0:
+                output_func(f"vfs-ls: invalid {arg[2:]}: '{args[i + 1]}'")
+                return
+            if arg == '--limit':
+                limit = value
+            else:
+                offset = value
+            i += 1
+        elif arg.startswith('-'):
             if 'a' in arg:
                 show_all = True
             if 'l' in arg:
                 long_format = True
+            if 'S' in arg:
+                sort = 'size'
+            if 't' in arg:
+                sort = 'time'
         else:
             target_path = arg
         i += 1
 
-    items = vfs.list_directory(target_path)
-    if items is None:
+    directory = vfs.find_node(target_path) if target_path else vfs.current_dir
+    if directory is None:
         output_func(f"vfs-ls: cannot access '{target_path}': No such file or directory")
         return
-
-    if not items:
-        output_func("(директория пуста)")
-        return
-
-    # Фильтруем скрытые файлы если не указан -a
-    if not show_all:
-        items = [item for item in items if not item.startswith('.')]
-
-    for item in items:
-        node = vfs.current_dir.children[item]
+    if not directory.is_directory:
+        nodes, total = [directory], 1
+    else:
+        nodes, total = vfs.list_page(directory, show_all, sort, offset, limit)
+        if not directory.children:
+            output_func("(директория пуста)")
+            return
+
+    batch = []
+    for node in nodes:
+        item = node.name
         if node.is_directory:
             if long_format:
                 # Для директории в длинном формате VFS
-                output_func(f"d--------- {node.owner} {node.group} {item}/")
+                batch.append(f"d--------- {node.owner} {node.group} {item}/")
             else:
-                output_func(item + "/")
+                batch.append(item + "/")
         else:
             if long_format:
                 # Для файла в длинном формате VFS
-                content_length = len(node.content) if node.content else 0
-                output_func(f"---------- {node.owner} {node.group} {content_length:>8} {item}")
+                content_length = vfs.get_size(node)
+                batch.append(f"---------- {node.owner} {node.group} {content_length:>8} {item}")
             else:
-                output_func(item)
+                batch.append(item)
+        if len(batch) >= LS_BATCH:
+            output_func('\n'.join(batch))
+            batch = []
+    if batch:
+        output_func('\n'.join(batch))
+
+    if nodes and limit is not None and offset + len(nodes) < total:
+        output_func(f"(показано {offset + 1}-{offset + len(nodes)} из {total}; "
+                    f"следующая страница: --offset {offset + len(nodes)})")
 
 
 def do_vfs_cd(args, output_func):
@@ -687,8 +2789,9 @@ def do_vfs_cat(args, output_func):
     if filename in vfs.current_dir.children:
         node = vfs.current_dir.children[filename]
         if not node.is_directory:
-            if node.content:
-                output_func(node.content)
+            content = vfs.get_content(node)
+            if content:
+                output_func(content)
             else:
                 output_func("(файл пуст)")
         else:
@@ -698,18 +2801,21 @@ def do_vfs_cat(args, output_func):
 
 
 def do_vfs_tail(args, output_func):
-    """Команда tail для VFS - вывод последних строк файла"""
+    """Команда tail для VFS - вывод последних строк файла
+
+    С -f следит за реальным файлом, из которого загружен узел VFS."""
     if not vfs.loaded:
         output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
         return
 
     if not args:
         output_func("vfs-tail: missing file operand")
-        output_func("Usage: vfs-tail [-n LINES] FILE")
+        output_func("Usage: vfs-tail [-f] [-n LINES] FILE")
         return
 
     # Параметры по умолчанию
     lines_count = 10
+    follow = False
     filename = None
 
     # Парсим аргументы
@@ -727,6 +2833,8 @@ def do_vfs_tail(args, output_func):
             else:
                 output_func("vfs-tail: option requires an argument -- 'n'")
                 return
+        elif arg == '-f':
+            follow = True
         elif arg.startswith('-') and len(arg) > 1 and arg[1:].isdigit():
             # Формат -5 (без пробела)
             lines_count = int(arg[1:])
@@ -738,22 +2846,137 @@ def do_vfs_tail(args, output_func):
         output_func("vfs-tail: missing file operand")
         return
 
-    if filename in vfs.current_dir.children:
-        node = vfs.current_dir.children[filename]
-        if not node.is_directory:
-            if node.content:
-                # Разбиваем содержимое на строки
-                all_lines = node.content.split('\n')
-                # Выводим последние lines_count строк
-                start_line = max(0, len(all_lines) - lines_count)
-                for line in all_lines[start_line:]:
-                    output_func(line)
+    node = vfs.find_node(filename)
+    if node is None:
+        output_func(f"vfs-tail: {filename}: No such file or directory")
+        return
+    if node.is_directory:
+        output_func(f"vfs-tail: {filename}: Is a directory")
+        return
+
+    if follow:
+        # Следить можно только за узлом, загруженным из реальной директории
+        if not isinstance(node.source, str):
+            output_func(f"vfs-tail: cannot follow '{filename}': not backed by a real file")
+            return
+        try:
+            end = os.stat(node.source).st_size
+        except OSError as e:
+            output_func(f"vfs-tail: cannot follow '{filename}': {e.strerror}")
+            return
+
+    if not vfs.get_content(node):
+        output_func("(файл пуст)")
+    elif lines_count > 0:
+        # Последние lines_count строк берем по индексу строк файла
+        lines, _ = vfs.get_lines(node, -lines_count, None)
+        output_func('\n'.join(lines))
+    if follow:
+        output_func(start_follow(f"vfs-tail -f {node.path}", node.source, end))
+
+
+def do_vfs_head(args, output_func):
+    """Команда head для VFS - вывод первых строк файла"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    lines_count = 10
+    filename = None
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-n':
+            if i + 1 < len(args):
+                try:
+                    lines_count = int(args[i + 1])
+                    i += 1
+                except ValueError:
+                    output_func(f"vfs-head: invalid number of lines: '{args[i + 1]}'")
+                    return
             else:
-                output_func("(файл пуст)")
-        else:
-            output_func(f"vfs-tail: {filename}: Is a directory")
+                output_func("vfs-head: option requires an argument -- 'n'")
+                return
+        elif arg.startswith('-') and len(arg) > 1 and arg[1:].isdigit():
+            lines_count = int(arg[1:])
+        elif not arg.startswith('-'):
+            filename = arg
+        i += 1
+
+    if not filename:
+        output_func("vfs-head: missing file operand")
+        output_func("Usage: vfs-head [-n LINES] FILE")
+        return
+
+    node = vfs.find_node(filename)
+    if node is None:
+        output_func(f"vfs-head: {filename}: No such file or directory")
+    elif node.is_directory:
+        output_func(f"vfs-head: {filename}: Is a directory")
+    elif lines_count > 0:
+        lines, _ = vfs.get_lines(node, 0, lines_count)
+        if lines:
+            output_func('\n'.join(lines))
+
+
+def parse_sed_range(script):
+    """Разбирает адрес sed вида N, A,B или A,$ с командой p
+
+    Возвращает (первая, последняя) строки с единицы; None вместо
+    последней - до конца файла, None вместо результата - ошибка."""
+    if not script.endswith('p'):
+        return None
+    parts = script[:-1].split(',')
+    if len(parts) > 2 or not all(parts):
+        return None
+    try:
+        bounds = [None if part == '$' else int(part) for part in parts]
+    except ValueError:
+        return None
+    if bounds[0] is None:
+        # $p - только последняя строка
+        return (-1, None) if len(bounds) == 1 else None
+    if bounds[0] < 1 or (len(bounds) == 2 and bounds[1] is not None and bounds[1] < 1):
+        return None
+    return bounds[0], bounds[-1]
+
+
+def do_vfs_sed(args, output_func):
+    """Команда sed для VFS - вывод диапазона строк файла (sed -n 'A,Bp')"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    if len(args) != 3 or args[0] != '-n':
+        output_func("vfs-sed: only line ranges are supported")
+        output_func("Usage: vfs-sed -n 'A,Bp' FILE   (A и B - номера строк, B может быть $)")
+        return
+
+    script, filename = args[1], args[2]
+    bounds = parse_sed_range(script)
+    if bounds is None:
+        output_func(f"vfs-sed: -e expression #1: invalid command: '{script}'")
+        return
+
+    node = vfs.find_node(filename)
+    if node is None:
+        output_func(f"vfs-sed: can't read {filename}: No such file or directory")
+        return
+    if node.is_directory:
+        output_func(f"vfs-sed: couldn't edit {filename}: not a regular file")
+        return
+
+    first, last = bounds
+    if last is not None and last < first:
+        # Как в sed: конец диапазона раньше начала - печатается одна строка
+        last = first
+    if first < 0:
+        lines, _ = vfs.get_lines(node, first, None)
     else:
-        output_func(f"vfs-tail: {filename}: No such file or directory")
+        lines, _ = vfs.get_lines(node, first - 1, last)
+    if lines:
+        output_func('\n'.join(lines))
 
 
 def do_vfs_whoami(args, output_func):
@@ -765,6 +2988,22 @@ def do_vfs_load(args, output_func):
     """Команда для загрузки VFS"""
     global vfs_path
 
+    if args and args[0] == '--image':
+        if len(args) < 2:
+            output_func("vfs-load: option requires an argument -- 'image'")
+            return
+        vfs_path = args[1]
+        if vfs.load_from_image(vfs_path):
+            output_func(f"VFS загружена из образа: {vfs_path}")
+            output_func(f"Узлов в образе: {vfs.image.node_count}")
+        else:
+            output_func(f"Ошибка загрузки VFS из образа: {vfs_path}")
+        return
+
+    lazy = '--lazy' in args
+    build_index = '--index' in args
+    args = [arg for arg in args if arg not in ('--lazy', '--index')]
+
     if not args:
         # Загружаем образцовую структуру по умолчанию
         if vfs.load_from_directory(None):
@@ -775,22 +3014,312 @@ def do_vfs_load(args, output_func):
     else:
         # Загружаем из реальной директории
         vfs_path = args[0]
-        if vfs.load_from_real_directory(vfs_path):
+        if vfs.load_from_real_directory(vfs_path, lazy=lazy):
             output_func(f"VFS загружена из: {vfs_path}")
             output_func(f"Загружено элементов: {vfs.loaded_items_count}")
+            if lazy:
+                output_func("Ленивый режим: директории читаются при первом обращении")
+            if build_index:
+                index = vfs.get_grep_index()
+                output_func(f"Индекс vfs-grep построен: {len(index)} файлов")
         else:
             output_func(f"Ошибка загрузки VFS из: {vfs_path}")
 
+
+def do_vfs_reload(args, output_func):
+    """Команда для обновления VFS по изменениям в реальной директории"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    if vfs.image or not isinstance(vfs.root.source, str):
+        output_func("vfs-reload: VFS загружена не из реальной директории")
+        return
+
+    counts = vfs.reload()
+    output_func(f"VFS обновлена из: {vfs.root.source}")
+    output_func(f"Перечитано директорий: {counts['rescanned']}")
+    output_func(f"Добавлено: {counts['added']}, удалено: {counts['removed']}, "
+                f"изменено: {counts['updated']}")
+
+
+def do_vfs_grep(args, output_func):
+    """Команда grep для VFS - поиск строк по регулярному выражению"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    recursive = ignore_case = line_numbers = False
+    operands = []
+    for i, arg in enumerate(args):
+        if arg == '--':
+            operands.extend(args[i + 1:])
+            break
+        if arg.startswith('-') and len(arg) > 1 and not operands:
+            for flag in arg[1:]:
+                if flag == 'r':
+                    recursive = True
+                elif flag == 'i':
+                    ignore_case = True
+                elif flag == 'n':
+                    line_numbers = True
+                else:
+                    output_func(f"vfs-grep: invalid option -- '{flag}'")
+                    return
+        else:
+            operands.append(arg)
+
+    if not operands:
+        output_func("vfs-grep: missing pattern")
+        output_func("Usage: vfs-grep [-r] [-i] [-n] PATTERN [PATH]")
+        return
+
+    pattern = operands[0]
+    paths = operands[1:]
+    if not paths:
+        if not recursive:
+            output_func("vfs-grep: missing file operand")
+            return
+        paths = ['.']
+
+    try:
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    except re.error as e:
+        output_func(f"vfs-grep: invalid pattern: {e}")
+        return
+
+    # Индекс помогает только для литеральных шаблонов не короче триграммы
+    literal = None
+    if len(pattern) >= 3 and not any(char in pattern for char in '.^$*+?{}[]\\|()'):
+        literal = pattern
+
+    show_names = recursive or len(paths) > 1
+    for path in paths:
+        node = vfs.find_node(path)
+        if not node:
+            output_func(f"vfs-grep: {path}: No such file or directory")
+            continue
+        if node.is_directory:
+            if not recursive:
+                output_func(f"vfs-grep: {path}: Is a directory")
+                continue
+            files = vfs.grep_files(node, literal)
+        else:
+            files = [node]
+
+        for file_node in files:
+            content = vfs.get_content(file_node)
+            if not regex.search(content):
+                continue
+            for number, line in enumerate(content.split('\n'), 1):
+                if regex.search(line):
+                    prefix = f"{file_node.get_path()}:" if show_names else ""
+                    if line_numbers:
+                        prefix += f"{number}:"
+                    output_func(prefix + line)
+
+
+def parse_size_test(spec):
+    """Разбирает аргумент -size ([+-]N[ckMG]) в функцию проверки размера"""
+    units = {'c': 1, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    sign = spec[:1] if spec[:1] in '+-' else ''
+    number = spec[len(sign):]
+    multiplier = 1
+    if number and number[-1] in units:
+        multiplier = units[number[-1]]
+        number = number[:-1]
+    if not number.isdigit():
+        return None
+    limit = int(number) * multiplier
+    if sign == '+':
+        return lambda size: size > limit
+    if sign == '-':
+        return lambda size: size < limit
+    return lambda size: size == limit
+
+
+def do_vfs_find(args, output_func):
+    """Команда find для VFS - поиск по имени, типу, размеру и владельцу"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    start_path = '.'
+    if args and not args[0].startswith('-'):
+        start_path = args[0]
+        args = args[1:]
+
+    options = {'name': None, 'node_type': None, 'size_test': None, 'owner': None}
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg not in ('-name', '-type', '-size', '-user'):
+            output_func(f"vfs-find: unknown predicate '{arg}'")
+            return
+        if i + 1 >= len(args):
+            output_func(f"vfs-find: missing argument to '{arg}'")
+            return
+        value = args[i + 1]
+        if arg == '-name':
+            options['name'] = value
+        elif arg == '-type':
+            if value not in ('f', 'd'):
+                output_func(f"vfs-find: unknown argument to -type: {value}")
+                return
+            options['node_type'] = value
+        elif arg == '-size':
+            options['size_test'] = parse_size_test(value)
+            if options['size_test'] is None:
+                output_func(f"vfs-find: invalid argument '{value}' to '-size'")
+                return
+        else:
+            options['owner'] = value
+        i += 2
+
+    start = vfs.find_node(start_path)
+    if not start:
+        output_func(f"vfs-find: '{start_path}': No such file or directory")
+        return
+
+    # Результаты выводятся по мере нахождения
+    for node in vfs.find(start, **options):
+        output_func(node.get_path())
+
+
+def do_vfs_save(args, output_func):
+    """Команда для сохранения VFS в бинарный образ"""
+    if not vfs.loaded:
+        output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
+        return
+
+    if not args:
+        output_func("vfs-save: missing image operand")
+        output_func("Usage: vfs-save IMAGE")
+        return
+
+    image_path = args[0]
+    try:
+        count = vfs.save_image(image_path)
+    except OSError as e:
+        output_func(f"vfs-save: cannot write '{image_path}': {e.strerror}")
+        return
+    output_func(f"VFS сохранена в образ: {image_path}")
+    output_func(f"Сохранено узлов: {count}, размер образа: {os.path.getsize(image_path)} байт")
+
 def do_vfs_status(args, output_func):
     """Команда для показа статуса VFS"""
     if vfs.loaded:
         output_func(f"VFS загружена из: {vfs_path}")
         output_func(f"Элементов в VFS: {vfs.loaded_items_count}")
+        if vfs.lazy:
+            output_func(f"Директорий загружено: {vfs.loaded_dirs_count}, "
+                        f"ожидают загрузки: {vfs.pending_dirs_count}")
+        if vfs.root.source is not None:
+            cache = vfs.content_cache
+            output_func(f"Кэш содержимого: {len(cache.entries)} файлов, "
+                        f"{cache.used_bytes // 1024} из {cache.max_bytes // 1024} КБ")
         output_func(f"Текущий путь в VFS: {vfs.get_current_path()}")
     else:
         output_func("VFS не загружена. Используйте 'vfs-load' для загрузки.")
 
 
+# === КОМАНДЫ УПРАВЛЕНИЯ ЗАДАНИЯМИ ===
+
+def do_jobs(args, output_func):
+    """Команда jobs - список фоновых заданий"""
+    for job in jobs.active():
+        output_func(f"[{job.id}]  {job.state:<10} {job.command}")
+
+
+def do_kill_job(args, output_func):
+    """Команда kill - остановка фонового задания по номеру (%N или N)"""
+    if not args:
+        output_func("kill: missing job id")
+        output_func("Usage: kill %N")
+        return
+
+    for spec in args:
+        try:
+            job_id = int(spec.lstrip('%'))
+        except ValueError:
+            output_func(f"kill: {spec}: arguments must be job IDs")
+            continue
+        job = jobs.kill(job_id)
+        if job is None:
+            output_func(f"kill: {spec}: no such job")
+        elif job.done.is_set():
+            output_func(f"[{job.id}]  Stopped    {job.command}")
+        # Выполняемая команда сама сообщит о прерывании (Terminated)
+
+
+# === КОМАНДЫ ПРОФИЛИРОВАНИЯ ===
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+
+def do_time(args, sink):
+    """Команда time - выполнение команды с выводом ее времени"""
+    if not args:
+        sink.write("time: missing command")
+        sink.write("Usage: time COMMAND [ARGS...]")
+        return
+
+    result, timing = profiler.measure(args, sink)
+    sink.write(f"real    {timing.wall:.3f}s")
+    sink.write(f"cpu     {timing.cpu:.3f}s")
+    sink.write(f"exec    {timing.execute - timing.render:.3f}s")
+    sink.write(f"render  {timing.render:.3f}s")
+    sink.write(f"output  {timing.bytes} bytes")
+    return result
+
+
+def do_stats(args, output_func):
+    """Команда stats - перцентили времени команд и экспорт замеров"""
+    if args and args[0] in ('--on', '--off', '--reset'):
+        if args[0] == '--reset':
+            profiler.reset()
+            output_func("Замеры очищены")
+        else:
+            profiler.enabled = args[0] == '--on'
+            output_func(f"Профилирование {'включено' if profiler.enabled else 'выключено'}")
+        return
+
+    if args and args[0] in ('--json', '--trace'):
+        if len(args) < 2:
+            output_func(f"stats: option requires an argument -- '{args[0]}'")
+            return
+        try:
+            profiler.export(args[1], 'json' if args[0] == '--json' else 'trace')
+        except OSError as e:
+            output_func(f"stats: cannot write '{args[1]}': {e.strerror}")
+            return
+        output_func(f"Замеры сохранены в {args[1]}")
+        return
+
+    if args:
+        output_func(f"stats: invalid option -- '{args[0]}'")
+        output_func("Usage: stats [--on | --off | --reset | --json FILE | --trace FILE]")
+        return
+
+    rows = profiler.summary()
+    if not rows:
+        if profiler.enabled:
+            output_func("Замеров пока нет")
+        else:
+            output_func("Профилирование выключено: запустите с --profile или выполните stats --on")
+        return
+
+    # Перцентили - полное время команды, остальные столбцы - средние, в мс
+    output_func(f"{'COMMAND':<16} {'COUNT':>6} {'P50':>9} {'P95':>9} {'P99':>9} "
+                f"{'PARSE':>8} {'EXEC':>9} {'RENDER':>9} {'CPU':>9} {'BYTES':>11}")
+    for row in rows:
+        output_func(f"{row['command']:<16} {row['count']:>6} {format_ms(row['p50']):>9} "
+                    f"{format_ms(row['p95']):>9} {format_ms(row['p99']):>9} "
+                    f"{format_ms(row['parse']):>8} {format_ms(row['execute']):>9} "
+                    f"{format_ms(row['render']):>9} {format_ms(row['cpu']):>9} {row['bytes']:>11}")
+
+
 # === СКРИПТЫ ===
 
 def get_script_path(script_name):
@@ -824,8 +3353,93 @@ def get_script_path(script_name):
     return None
 
 
-def run_script(script_name, output_widget, output_func):
-    """Выполняет скрипт из файла"""
+class ScriptError(Exception):
+    """Ошибка при выполнении строки скрипта; сообщение содержит номер строки"""
+
+
+def compile_lines(lines):
+    """Разбирает строки скрипта в записи (номер строки, текст, argv, ошибка)
+
+    Пустые строки и комментарии пропускаются, номера строк считаются по
+    исходному файлу. Если строку не удалось разобрать, argv - None, а в
+    последнем поле - текст ошибки: она сообщается при выполнении строки,
+    как и раньше. Генератор, поэтому годится и для чтения stdin."""
+    for line_number, line in enumerate(lines, 1):
+        text = line.strip()
+        if not text or text.startswith('#'):
+            continue
+        try:
+            yield line_number, text, split_command(text), None
+        except ValueError as e:
+            yield line_number, text, None, str(e)
+
+
+class ScriptCache:
+    """Кэш скомпилированных скриптов: путь -> ((st_mtime_ns, st_size), записи)
+
+    Скрипт читается и разбирается заново, только если файл изменился."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, path):
+        """Записи compile_lines для файла path (OSError, если его нельзя прочитать)
+
+        Ключ кэша - абсолютный путь: --precompile с относительной директорией
+        и run_script (get_script_path) должны попадать в одну запись."""
+        path = os.path.abspath(path)
+        info = os.stat(path)
+        key = (info.st_mtime_ns, info.st_size)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with open(path, 'r', encoding='utf-8') as file:
+            records = tuple(compile_lines(file))
+        self.entries[path] = (key, records)
+        return records
+
+    def precompile(self, directory):
+        """Компилирует все скрипты (*.txt) директории, возвращает их число"""
+        count = 0
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.txt') and entry.is_file():
+                self.get(entry.path)
+                count += 1
+        return count
+
+
+script_cache = ScriptCache()
+
+
+def run_records(records, sink):
+    """Выполняет записи скрипта, выводя каждую команду с приглашением"""
+    for line_number, text, argv, error in records:
+        check_cancelled()
+        # Выводим команду (имитация ввода пользователя)
+        sink.write(f"{vfs_name}$ {text}")
+        if argv is None:
+            raise ScriptError(f"строка {line_number}: {error}")
+
+        # Выполняем команду
+        try:
+            result = execute_argv(argv, sink)
+        except Exception as e:
+            raise ScriptError(f"строка {line_number}: {e}") from e
+        # Переносим накопившийся вывод фоновых заданий. В окне скрипт выполняет
+        # рабочий поток - виджет Tk трогать из него нельзя, вывод перенесет pump_jobs
+        if threading.current_thread() is threading.main_thread():
+            jobs.drain()
+        if result == "exit":
+            return "exit"
+
+
+def run_lines(lines, sink):
+    """Выполняет последовательность строк команд (например, из stdin)"""
+    return run_records(compile_lines(lines), sink)
+
+
+def run_script(script_name, sink, output_func):
+    """Выполняет скрипт из файла (разобранный скрипт берется из script_cache)"""
     script_path = get_script_path(script_name)
 
     if not script_path:
@@ -834,30 +3448,13 @@ def run_script(script_name, output_widget, output_func):
         return False
 
     try:
-        with open(script_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
+        records = script_cache.get(script_path)
 
         output_func(f"=== Выполнение скрипта {os.path.basename(script_path)} ===")
 
-        for line_num, line in enumerate(lines, 1):
-            line = line.strip()
-
-            # Пропускаем пустые строки и комментарии
-            if not line or line.startswith('#'):
-                continue
-
-            # Выводим команду (имитация ввода пользователя)
-            output_widget.config(state=tk.NORMAL)
-            output_widget.insert(tk.END, f"{vfs_name}$ {line}\n")
-            output_widget.config(state=tk.DISABLED)
-            output_widget.see(tk.END)
-            output_widget.update()
-
-            # Выполняем команду
-            result = execute_command(line, output_widget, show_command=False)
-            if result == "exit":
-                output_func("Скрипт прерван командой exit")
-                return True
+        if run_records(records, sink) == "exit":
+            output_func("Скрипт прерван командой exit")
+            return True
 
         output_func(f"=== Скрипт {os.path.basename(script_path)} завершен ===")
         return True
@@ -867,117 +3464,361 @@ def run_script(script_name, output_widget, output_func):
         return False
 
 
-def execute_command(command, output_widget, show_command=True):
-    """Выполняет команду и выводит результат в виджет"""
+# === ТАБЛИЦА КОМАНД ===
+
+def make_script_command(script_name):
+    """Обработчик команды, запускающей встроенный скрипт script_name"""
+    def handler(args, sink):
+        run_script(script_name, sink, sink.write)
+    return handler
+
+
+register_command('ls', do_ls, 'ls [-a] [-l] [-R] [DIR]', 'список файлов директории', category='Основные',
+                 paths='real', options='alR')
+register_command('cd', do_cd, 'cd [DIR]', 'смена текущей директории', category='Основные',
+                 paths='real', options='', operands=(0, 1))
+register_command('pwd', do_pwd, 'pwd', 'текущая директория', category='Основные')
+register_command('echo', do_echo, 'echo [TEXT...]', 'вывод текста', category='Основные')
+register_command('cat', do_cat, 'cat [--max-bytes N] FILE...', 'вывод файлов потоком',
+                 category='Основные', paths='real', options='', long_options=('max-bytes=',),
+                 operands=(1, None))
+register_command('tail', do_tail, 'tail [-f] [-n LINES | -c BYTES] FILE',
+                 'последние строки или байты файла, -f - слежение за файлом', category='Основные',
+                 paths='real')
+register_command('whoami', do_whoami, 'whoami', 'текущий пользователь', category='Основные',
+                 options='', operands=(0, 0))
+register_command(exit_cmd, do_exit, 'exit', 'выход из эмулятора (в скрипте - завершение скрипта)',
+                 category='Основные', inline=True)
+register_command('help', do_help, 'help [COMMAND]', 'список команд или справка по команде',
+                 aliases=('?',), category='Основные', inline=True, options='', operands=(0, 1))
+
+register_command('jobs', do_jobs, 'jobs', 'список заданий: команды окна, tail -f, vfs-tail -f',
+                 category='Фоновые задания', inline=True)
+register_command('kill', do_kill_job, 'kill %N...',
+                 'остановка задания; Ctrl+C в окне - текущей команды или последнего задания',
+                 aliases=('kill-job',), category='Фоновые задания', inline=True)
+
+register_command('time', do_time, 'time COMMAND [ARGS...]',
+                 'время выполнения команды: полное, CPU, вывод', category='Профилирование',
+                 pass_sink=True)
+register_command('stats', do_stats, 'stats [--on | --off | --reset | --json FILE | --trace FILE]',
+                 'перцентили времени команд (p50/p95/p99), экспорт в JSON и Chrome trace',
+                 category='Профилирование', options='',
+                 long_options=('on', 'off', 'reset', 'json=', 'trace='), operands=(0, 0))
+
+register_command('vfs-load', do_vfs_load, 'vfs-load [--lazy] [--index] [PATH] | vfs-load --image IMAGE',
+                 'загрузка VFS: образцовая структура, реальная директория или образ', category='VFS',
+                 paths='real', options='', long_options=('lazy', 'index', 'image='), operands=(0, 1))
+register_command('vfs-ls', do_vfs_ls, 'vfs-ls [-a] [-l] [-S | -t] [--offset N] [--limit N] [PATH]',
+                 'список файлов VFS по имени, размеру (-S) или времени (-t), постранично',
+                 category='VFS', paths='vfs', options='alSt', long_options=('offset=', 'limit='),
+                 operands=(0, 1))
+register_command('vfs-cd', do_vfs_cd, 'vfs-cd PATH', 'смена текущей директории VFS', category='VFS',
+                 paths='vfs', options='', operands=(0, 1))
+register_command('vfs-pwd', do_vfs_pwd, 'vfs-pwd', 'текущий путь в VFS', category='VFS',
+                 options='', operands=(0, 0))
+register_command('vfs-cat', do_vfs_cat, 'vfs-cat FILE', 'содержимое файла VFS', category='VFS',
+                 paths='vfs', options='', operands=(1, 1))
+register_command('vfs-head', do_vfs_head, 'vfs-head [-n LINES] FILE', 'первые строки файла VFS',
+                 category='VFS', paths='vfs')
+register_command('vfs-tail', do_vfs_tail, 'vfs-tail [-f] [-n LINES] FILE',
+                 'последние строки файла VFS, -f - слежение за реальным файлом', category='VFS',
+                 paths='vfs')
+register_command('vfs-sed', do_vfs_sed, "vfs-sed -n 'A,Bp' FILE", 'диапазон строк файла VFS',
+                 category='VFS', paths='vfs')
+register_command('vfs-whoami', do_vfs_whoami, 'vfs-whoami', 'пользователь VFS', category='VFS',
+                 options='', operands=(0, 0))
+register_command('vfs-status', do_vfs_status, 'vfs-status', 'статус VFS', category='VFS',
+                 options='', operands=(0, 0))
+register_command('vfs-save', do_vfs_save, 'vfs-save IMAGE', 'сохранение VFS в бинарный образ',
+                 category='VFS', paths='real', options='', operands=(1, 1))
+register_command('vfs-reload', do_vfs_reload, 'vfs-reload',
+                 'обновление VFS из реальной директории', category='VFS',
+                 options='', operands=(0, 0))
+register_command('vfs-find', do_vfs_find,
+                 'vfs-find [PATH] [-name GLOB] [-type f|d] [-size [+-]N[ckMG]] [-user OWNER]',
+                 'поиск файлов и директорий VFS', category='VFS', paths='vfs')
+register_command('vfs-grep', do_vfs_grep, 'vfs-grep [-r] [-i] [-n] PATTERN [PATH]',
+                 'поиск строк в файлах VFS', category='VFS', paths='vfs')
+register_command('vfs-chown', do_vfs_chown, 'vfs-chown OWNER[:GROUP] FILE',
+                 'смена владельца файла VFS', category='VFS', paths='vfs')
+
+for script_category, script_names in (
+        ('Скрипты', ('basic_commands', 'navigation', 'error_test')),
+        ('VFS-скрипты', ('vfs_deepstruct_test', 'vfs_error_test', 'vfs_all_test',
+                         'vfs_search_test')),
+        ('Скрипт для проверки всей системы', ('system_test',)),
+        ('Скрипт этапа 4', ('stage4_test',)),
+        ('Скрипт этапа 5', ('stage5_test',))):
+    for script_name in script_names:
+        register_command(script_name, make_script_command(script_name), script_name,
+                         f'выполнение скрипта {script_name}.txt', category=script_category,
+                         pass_sink=True)
+
+
+# Аргументы без кавычек, обратной косой черты и необычных пробелов
+# разбираются str.split - он в несколько раз быстрее shlex.split
+NEEDS_SHLEX = re.compile(r'[\'"\\]|[^\S \t]')
+
+
+def split_command(command):
+    """Разбивает строку команды на слова по правилам shell"""
+    if NEEDS_SHLEX.search(command) is None:
+        return command.split()
+    return shlex.split(command)
+
+
+def runs_inline(command):
+    """Выполняется ли команда в окне сразу, минуя рабочий поток (Command.inline)"""
+    words = command.split(None, 1)
+    entry = COMMANDS.get(words[0]) if words else None
+    return entry is not None and entry.inline
+
+
+def execute_command(command, sink, show_command=True):
+    """Выполняет команду и выводит результат в приемник вывода"""
     if show_command:
-        output_widget.config(state=tk.NORMAL)
-        output_widget.insert(tk.END, f"{vfs_name}$ {command}\n")
-        output_widget.config(state=tk.DISABLED)
-        output_widget.see(tk.END)
-        output_widget.update()
-
-    parts = shlex.split(command)
-    if not parts:
+        sink.write(f"{vfs_name}$ {command}")
+
+    if not profiler.enabled:
+        return execute_argv(split_command(command), sink)
+    start = time.perf_counter()
+    argv = split_command(command)
+    return execute_argv(argv, sink, time.perf_counter() - start)
+
+
+def execute_argv(argv, sink, parse=0.0):
+    """Выполняет уже разобранную команду argv (имя и аргументы)
+
+    При включенном профилировании команда замеряется; parse - время
+    разбора ее строки."""
+    if not argv:
         return
+    if profiler.enabled:
+        return profiler.measure(argv, sink, parse)[0]
+    return dispatch_argv(argv, sink)
+
 
-    cmd = parts[0]
-    args = parts[1:]
+def dispatch_argv(argv, sink):
+    """Вызывает обработчик команды argv из реестра"""
+    cmd = argv[0]
+    args = argv[1:]
 
-    # Функция для вывода в текстовый виджет
-    def output_func(text):
-        output_widget.config(state=tk.NORMAL)
-        output_widget.insert(tk.END, f"{text}\n")
-        output_widget.config(state=tk.DISABLED)
-        output_widget.see(tk.END)
-        output_widget.update()
+    # Функция для вывода в приемник
+    output_func = sink.write
 
     # Обработка переменных окружения
     if cmd.startswith('$'):
         do_parc([cmd[1:]], output_func)
-    # Команды реальной файловой системы
-    elif cmd == exit_cmd:
-        return "exit"
-    elif cmd == 'ls':
-        do_ls(args, output_func)
-    elif cmd == 'cd':
-        do_cd(args, output_func)
-    elif cmd == 'pwd':
-        do_pwd(args, output_func)
-    elif cmd == 'echo':
-        do_echo(args, output_func)
-    elif cmd == 'cat':
-        do_cat(args, output_func)
-    elif cmd == 'tail':
-        do_tail(args, output_func)
-    elif cmd == 'whoami':
-        do_whoami(args, output_func)
-    # Команды VFS
-    elif cmd == 'vfs-ls':
-        do_vfs_ls(args, output_func)
-    elif cmd == 'vfs-cd':
-        do_vfs_cd(args, output_func)
-    elif cmd == 'vfs-pwd':
-        do_vfs_pwd(args, output_func)
-    elif cmd == 'vfs-cat':
-        do_vfs_cat(args, output_func)
-    elif cmd == 'vfs-tail':
-        do_vfs_tail(args, output_func)
-    elif cmd == 'vfs-whoami':
-        do_vfs_whoami(args, output_func)
-    elif cmd == 'vfs-load':
-        do_vfs_load(args, output_func)
-    elif cmd == 'vfs-status':
-        do_vfs_status(args, output_func)
-    elif cmd == 'vfs-chown':
-        do_vfs_chown(args, output_func)
-    elif cmd == 'help':
-        do_help(args, output_func)
-    # Запуск скриптов
-    elif cmd in ['basic_commands', 'navigation', 'error_test',
-                 'vfs_deepstruct_test', 'vfs_error_test',
-                 'vfs_all_test', 'system_test', 'stage4_test', "stage5_test"]:
-        run_script(cmd, output_widget, output_func)
-    else:
+        return
+
+    command_entry = COMMANDS.get(cmd)
+    if command_entry is None:
         output_func(f'{cmd}: command not found')
+        return
+    if command_entry.options is not None:
+        error = check_arguments(command_entry, args)
+        if error is not None:
+            output_func(f"{cmd}: {error}")
+            output_func(f"Usage: {command_entry.usage}")
+            return
+    if command_entry.pass_sink:
+        return command_entry.handler(args, sink)
+    else:
+        return command_entry.handler(args, output_func)
 
 
-def main():
-    # Парсим аргументы командной строки
-    args = parse_arguments()
+# === ДОПОЛНЕНИЕ ПО TAB ===
 
-    global vfs_path, startup_script
-    vfs_path = args.vfs_path
-    startup_script = args.startup_script
+COMPLETION_LIMIT = 200       # Сколько вариантов дополнения показывать в окне
+COMPLETION_CACHE_SIZE = 16   # Сколько листингов реальных директорий держать в кеше
+
+# Последнее слово строки ввода: пробелы внутри него экранированы '\\'
+LAST_WORD = re.compile(r'(?:\\.|[^\s\\])*\\?$')
+UNESCAPE = re.compile(r'\\(.)')
+ESCAPE = re.compile(r'([\s\'"\\])')
+
+
+def prefix_range(names, prefix):
+    """Границы [lo, hi) имен с началом prefix в отсортированном списке names
+
+    Два бинарных поиска: нижняя граница - сам prefix, верхняя - prefix
+    с увеличенным последним символом. Время O(log n) при любом числе
+    совпадений."""
+    lo = bisect.bisect_left(names, prefix)
+    if not prefix:
+        return lo, len(names)
+    return lo, bisect.bisect_left(names, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo)
 
-    # Автоматически загружаем VFS если указан путь
-    if vfs_path:
-        vfs.load_from_real_directory(vfs_path)
+
+class RealListingCache:
+    """Отсортированные списки имен реальных директорий для дополнения путей
+
+    Листинг читается один раз и перечитывается, только когда меняется
+    mtime директории; так каждое нажатие Tab - stat и бинарный поиск, а не
+    scandir всей директории."""
+
+    def __init__(self, size=COMPLETION_CACHE_SIZE):
+        self.size = size
+        self.listings = OrderedDict()  # путь -> (mtime_ns, имена по возрастанию)
+
+    def get(self, path):
+        """Имена директории path по возрастанию или None, если она не читается"""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self.listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            self.listings.move_to_end(path)
+            return cached[1]
+        try:
+            with os.scandir(path) as entries:
+                names = sorted(entry.name for entry in entries)
+        except OSError:
+            return None
+        self.listings[path] = (mtime, names)
+        if len(self.listings) > self.size:
+            self.listings.popitem(last=False)
+        return names
+
+
+real_listings = RealListingCache()
+
+
+def complete_real_path(directory, prefix):
+    """Варианты дополнения пути реальной ФС: (имена, lo, hi, признак директории)"""
+    real_directory = os.path.expanduser(directory) or '.'
+    names = real_listings.get(real_directory)
+    if names is None:
+        return [], 0, 0, None
+    lo, hi = prefix_range(names, prefix)
+    return names, lo, hi, lambda name: os.path.isdir(os.path.join(real_directory, name))
+
+
+def complete_vfs_path(directory, prefix):
+    """Варианты дополнения пути VFS: (имена, lo, hi, признак директории)
+
+    Имена берутся из VFSNode.order уже загруженных директорий: отложенные
+    (ленивая загрузка) не дочитываются, чтобы дополнение из главного
+    потока не меняло VFS. Вызывается под jobs.running (см. complete_line)."""
+    node = vfs.root if directory.startswith('/') else vfs.current_dir
+    for part in directory.split('/'):
+        if part == '..':
+            node = node.parent or node
+        elif part and part != '.':
+            node = node.children.get(part)
+            if node is None or not node.is_directory:
+                return [], 0, 0, None
+    names = node.order
+    lo, hi = prefix_range(names, prefix)
+    children = node.children
+    return names, lo, hi, lambda name: name in children and children[name].is_directory
+
+
+def complete_line(text):
+    """Дополняет строку ввода text (текст до курсора) по Tab
+
+    Первое слово дополняется именами команд реестра, остальные - путями
+    VFS или реальной ФС в зависимости от Command.paths. Возвращает новый
+    текст, варианты (не больше COMPLETION_LIMIT) и их общее число.
+
+    Пути VFS дополняются, только если рабочий поток не выполняет команду
+    (jobs.running свободен): vfs-load и vfs-reload заменяют и меняют дерево."""
+    match = LAST_WORD.search(text)
+    head = text[:match.start()]
+    word = UNESCAPE.sub(r'\1', match.group())
+
+    if not head.strip():
+        lo, hi = prefix_range(COMMAND_NAMES, word)
+        return completion_result(text, head, '', COMMAND_NAMES, lo, hi)
+
+    command = COMMANDS.get(head.split(None, 1)[0])
+    paths = command.paths if command is not None else None
+    # Директория остается как есть, дополняется только последнее имя
+    directory, prefix = word[:word.rfind('/') + 1], word[word.rfind('/') + 1:]
+    if paths == 'real':
+        return completion_result(text, head, directory, *complete_real_path(directory, prefix))
+    if paths != 'vfs' or not jobs.running.acquire(blocking=False):
+        return text, [], 0
+    try:
+        if not vfs.loaded:
+            return text, [], 0
+        return completion_result(text, head, directory, *complete_vfs_path(directory, prefix))
+    finally:
+        jobs.running.release()
+
+
+def completion_result(text, head, directory, names, lo, hi, is_directory=None):
+    """Строка ввода после дополнения, варианты и их число по диапазону [lo, hi) names"""
+    if lo == hi:
+        return text, [], 0
+    # Общее начало отсортированного диапазона - общее начало первого и последнего имени
+    common = os.path.commonprefix([names[lo], names[hi - 1]])
+    suffix = ''
+    if hi - lo == 1:
+        suffix = '/' if is_directory is not None and is_directory(common) else ' '
+    completed = head + ESCAPE.sub(r'\\\1', directory + common) + suffix
+    return completed, names[lo:min(hi, lo + COMPLETION_LIMIT)], hi - lo
+
+
+def run_batch(script, sink):
+    """Выполняет скрипт или команды из stdin без графического интерфейса
+
+    После скрипта ждет завершения фоновых заданий (tail -f), как shell
+    ждет задание переднего плана; Ctrl+C останавливает их."""
+    jobs.attach(sink)
+    try:
+        if script == '-':
+            run_lines(sys.stdin, sink)
+        else:
+            run_records(script_cache.get(get_script_path(script) or script), sink)
+    except (OSError, ScriptError) as e:
+        sink.write(f"Ошибка выполнения скрипта: {e}")
+        sink.flush()
+        return 1
+    jobs.wait()
+    sink.flush()
+    return 0
+
+
+def run_gui(args):
+    """Запускает графический интерфейс эмулятора"""
+    import tkinter as tk
+    from tkinter import scrolledtext
 
     # Создаем главное окно
     root = tk.Tk()
-    root.title(f"Эмулятор - [{os.getlogin()}]")
+    root.title(f"Эмулятор - [{vfs_name}]")
     root.configure(bg='black')
 
-    # Создаем текстовое поле для вывода
-    output_text = scrolledtext.ScrolledText(
-        root,
-        wrap=tk.WORD,
+    archive = ScrollbackArchiver(args.scrollback_log) if args.scrollback_log else None
+    text_options = dict(
         bg='black',
         fg='white',
         insertbackground='white',
         font=('Courier', 10),
         height=25,
-        width=80,
-        state=tk.DISABLED
+        width=80
     )
-    output_text.pack(padx=5, pady=5, fill=tk.BOTH, expand=True)
 
-    # Функция для вывода в текстовый виджет
-    def output_func(text):
-        output_text.config(state=tk.NORMAL)
-        output_text.insert(tk.END, f"{text}\n")
-        output_text.config(state=tk.DISABLED)
-        output_text.see(tk.END)
+    if args.virtual_output:
+        # Строки хранятся в LineStore, в виджете - только видимая часть
+        view = VirtualOutputView(root, LineStore(args.scrollback, archive), **text_options)
+        view.pack(padx=5, pady=5, fill=tk.BOTH, expand=True)
+        sink = VirtualViewSink(view, args.flush_interval, args.flush_batch)
+    else:
+        # Создаем текстовое поле для вывода
+        view = None
+        output_text = scrolledtext.ScrolledText(
+            root,
+            wrap=tk.WORD,
+            state=tk.DISABLED,
+            **text_options
+        )
+        output_text.pack(padx=5, pady=5, fill=tk.BOTH, expand=True)
+        sink = TextWidgetSink(output_text, args.flush_interval, args.flush_batch,
+                              args.scrollback, archive)
 
     # Создаем поле для ввода команды
     input_frame = tk.Frame(root, bg='black')
@@ -1003,17 +3844,114 @@ def main():
     command_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
     command_entry.focus()
 
+    # Вывод команд и фоновых заданий переносится в окно таймером, а не из их потоков
+    jobs.attach(sink)
+
     def on_enter(event):
         command = command_entry.get().strip()
         command_entry.delete(0, tk.END)
 
-        if command:
-            result = execute_command(command, output_text)
-            if result == "exit":
+        if not command:
+            return
+        if runs_inline(command):
+            # jobs, kill, exit и т.п. не ждут окончания выполняемой команды
+            jobs.drain(sys.maxsize)
+            if execute_command(command, sink) == "exit":
                 root.quit()
+        else:
+            # Остальные команды выполняет рабочий поток, окно не блокируется
+            jobs.submit(command)
 
     command_entry.bind('<Return>', on_enter)
 
+    def on_tab(event):
+        # Дополнение команды или пути перед курсором; если дополнить нечем -
+        # список вариантов в окне вывода
+        cursor = command_entry.index(tk.INSERT)
+        line = command_entry.get()
+        text, candidates, total = complete_line(line[:cursor])
+        if text != line[:cursor]:
+            command_entry.delete(0, cursor)
+            command_entry.insert(0, text)
+            command_entry.icursor(len(text))
+        elif len(candidates) > 1:
+            jobs.drain(sys.maxsize)
+            sink.write(f"{vfs_name}$ {line}")
+            sink.write('  '.join(candidates))
+            if total > len(candidates):
+                sink.write(f"... и еще {total - len(candidates)}")
+        return "break"
+
+    command_entry.bind('<Tab>', on_tab)
+
+    spinner = '|/-\\'
+    ticks = 0
+
+    def pump_jobs():
+        nonlocal ticks
+        jobs.drain(JOBS_PUMP_BATCH)
+        if jobs.exit_requested:
+            root.quit()
+            return
+        # Индикатор занятости: крутящийся символ и число ожидающих команд
+        if jobs.busy():
+            ticks += 1
+            waiting = jobs.commands.qsize()
+            queued = f" +{waiting}" if waiting else ""
+            prompt_label.config(text=f"{vfs_name}$ [{spinner[ticks // 8 % 4]}{queued}] ", fg='yellow')
+        elif ticks:
+            ticks = 0
+            prompt_label.config(text=f"{vfs_name}$ ", fg='green')
+        root.after(JOBS_PUMP_INTERVAL, pump_jobs)
+
+    def on_interrupt(event):
+        # Ctrl+C прерывает выполняемую команду, а если ее нет - последнее задание
+        job = jobs.current
+        if job is not None:
+            jobs.kill(job.id)
+            sink.write("^C")
+            return "break"
+        active = jobs.active()
+        job = jobs.kill(active[-1].id) if active else None
+        if job is None:
+            return None
+        sink.write(f"^C\n[{job.id}]  Stopped    {job.command}")
+        return "break"
+
+    root.after(JOBS_PUMP_INTERVAL, pump_jobs)
+    command_entry.bind('<Control-c>', on_interrupt)
+
+    if view:
+        # Поиск по выводу (Ctrl+F) и прокрутка с клавиатуры
+        search_entry = tk.Entry(
+            input_frame,
+            bg='black',
+            fg='yellow',
+            insertbackground='yellow',
+            font=('Courier', 10),
+            width=20
+        )
+
+        def show_search(event):
+            search_entry.pack(side=tk.RIGHT)
+            search_entry.focus()
+            return "break"
+
+        def hide_search(event):
+            search_entry.pack_forget()
+            command_entry.focus()
+
+        def on_search(event):
+            if not view.search(search_entry.get()):
+                root.bell()
+
+        root.bind('<Control-f>', show_search)
+        search_entry.bind('<Return>', on_search)
+        search_entry.bind('<Escape>', hide_search)
+        command_entry.bind('<Prior>', lambda event: view.scroll(-1, 'pages'))
+        command_entry.bind('<Next>', lambda event: view.scroll(1, 'pages'))
+        command_entry.bind('<Control-End>', lambda event: view.see_end())
+
     # Обработчик закрытия окна
     def on_closing():
         root.quit()
@@ -1022,7 +3960,64 @@ def main():
 
     # Запускаем главный цикл
     root.mainloop()
+    jobs.kill_all()
+    jobs.drain()
+    sink.close()
+
+
+def main():
+    # Парсим аргументы командной строки
+    args = parse_arguments()
+
+    global vfs_path, startup_script
+    vfs_path = args.vfs_path
+    startup_script = args.startup_script
+
+    for plugin in args.plugin:
+        try:
+            load_plugin(plugin)
+        except Exception as e:
+            print(f"Ошибка загрузки плагина {plugin}: {e}", file=sys.stderr)
+            return 1
+
+    for directory in args.precompile:
+        try:
+            script_cache.precompile(directory)
+        except OSError as e:
+            print(f"Ошибка компиляции скриптов {directory}: {e}", file=sys.stderr)
+            return 1
+
+    profiler.enabled = args.profile or bool(args.profile_output)
+
+    vfs.content_cache.max_bytes = args.vfs_cache_mb * 1024 * 1024
+    vfs.workers = args.vfs_workers
+
+    # Автоматически загружаем VFS если указан путь или образ
+    if args.vfs_image:
+        vfs_path = args.vfs_image
+        vfs.load_from_image(vfs_path)
+    elif vfs_path:
+        vfs.load_from_real_directory(vfs_path, lazy=args.vfs_lazy)
+
+    if args.batch:
+        # Пакетный режим - Tk не импортируется и не запускается
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as stream:
+                status = run_batch(args.batch, StreamSink(stream))
+        else:
+            status = run_batch(args.batch, StreamSink(sys.stdout))
+    else:
+        run_gui(args)
+        status = 0
+
+    if args.profile_output:
+        try:
+            profiler.export(args.profile_output, args.profile_format)
+        except OSError as e:
+            print(f"Ошибка сохранения замеров {args.profile_output}: {e}", file=sys.stderr)
+            return 1
+    return status
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())